@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 from omegaconf import MISSING
 
@@ -22,3 +23,4 @@ class HttpEnvConfig(EnvConfig):
     port: int = MISSING
     docker_image_name: str = MISSING
     docker_container_name: str = MISSING
+    container_port: Optional[int] = None
@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 from hydra.core.config_store import ConfigStore
 from omegaconf import MISSING
@@ -13,6 +14,8 @@ class EvalConfig:
     env: EnvConfig = MISSING
     agent: AgentConfig = MISSING
     data_source: DataSourceConfig = MISSING
+    max_concurrent_projects: int = 1
+    trajectories_path: Optional[str] = None
 
 
 cs = ConfigStore.instance()
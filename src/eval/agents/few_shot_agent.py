@@ -1,7 +1,7 @@
-from langchain_openai import ChatOpenAI
 from openai import AsyncOpenAI
 
 from src.eval.agents.base_agent import BaseAgent
+from src.eval.agents.utils.openai_utils import create_chat
 from src.eval.agents.utils.tokenization_utils import TokenizationUtils
 from src.eval.envs.base_env import BaseEnv
 from src.eval.prompts.few_shot_prompt import FewShotPrompt
@@ -41,9 +41,9 @@ class FewShotAgent(BaseAgent):
 
         # description = chat_response.choices[0].message.content
 
-        model = ChatOpenAI(model_name=self._model_name, temperature=self._temperature, model_kwargs=self._model_kwargs)
+        model = create_chat(self._model_name, self._temperature, self._model_kwargs)
 
-        description = model.invoke(execution_prompt + user_prompt).content
+        description = (await model.ainvoke(execution_prompt + user_prompt)).content
 
         await env.run_command('create_template', {'description': description})
 
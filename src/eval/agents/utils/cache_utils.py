@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+
+LLM_CACHE_PATH = 'LLM_CACHE_PATH'  # Path to the sqlite cache file, cache is disabled if not set
+LLM_CACHE_MODE = 'LLM_CACHE_MODE'  # "read_write" (default) or "offline" to fail on cache misses instead of requesting
+LLM_CACHE_MAX_SIZE_MB = 'LLM_CACHE_MAX_SIZE_MB'
+DEFAULT_MAX_SIZE_MB = 1024
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of LLM responses with size-bounded LRU eviction.
+
+    In offline mode the cache is read-only and a miss raises `CacheMissError` instead of falling back to the API.
+    """
+
+    def __init__(self, cache_path: str, max_size_bytes: int, offline: bool = False):
+        self.cache_path = cache_path
+        self.max_size_bytes = max_size_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+            )
+            self._connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self._size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def get_key(**request: Any) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                if self.offline:
+                    raise CacheMissError(f"Response {key} is not cached and the cache is in offline mode")
+                return None
+            if not self.offline:
+                with self._connection:
+                    self._connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, value: str):
+        if self.offline:
+            return
+        size = len(value.encode())
+        with self._lock, self._connection:
+            previous = self._connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if previous is not None:
+                self._size -= previous[0]
+            self._connection.execute('INSERT OR REPLACE INTO responses (key, value, size, last_access) '
+                                     'VALUES (?, ?, ?, ?)', (key, value, size, time.time()))
+            self._size += size
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_size_bytes:
+            row = self._connection.execute(
+                'SELECT key, size FROM responses ORDER BY last_access LIMIT 1').fetchone()
+            if row is None:
+                break
+            key, size = row
+            self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._size -= size
+
+
+class ResponseLangchainCache(BaseCache):
+    """LangChain adapter for `ResponseCache`, keys already include the model, messages, tools and sampling params."""
+
+    def __init__(self, response_cache: ResponseCache):
+        self._response_cache = response_cache
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        value = self._response_cache.get(ResponseCache.get_key(prompt=prompt, llm_string=llm_string))
+        if value is None:
+            return None
+        return [loads(generation) for generation in json.loads(value)]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self._response_cache.put(ResponseCache.get_key(prompt=prompt, llm_string=llm_string),
+                                 json.dumps([dumps(generation) for generation in return_val]))
+
+    def clear(self, **kwargs: Any) -> None:
+        pass
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Returns the process-wide response cache configured by environment variables or None if it is disabled."""
+    global _response_cache
+    cache_path = os.environ.get(LLM_CACHE_PATH)
+    if not cache_path:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            max_size_mb = int(os.environ.get(LLM_CACHE_MAX_SIZE_MB, DEFAULT_MAX_SIZE_MB))
+            offline = os.environ.get(LLM_CACHE_MODE, 'read_write') == 'offline'
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            _response_cache = ResponseCache(cache_path, max_size_mb * 1024 * 1024, offline)
+    return _response_cache
+
+
+def get_langchain_cache() -> Optional[BaseCache]:
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return None
+    return ResponseLangchainCache(response_cache)
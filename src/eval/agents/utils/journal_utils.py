@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional, Sequence
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+
+_current_journal: ContextVar[Optional['TrajectoryJournal']] = ContextVar('current_journal', default=None)
+
+
+class TrajectoryReplayError(Exception):
+    pass
+
+
+class TrajectoryJournal:
+    """Incrementally persisted journal of LLM generations and env calls made during a single agent run.
+
+    Every entry is appended to a jsonl file as soon as it is received. When the run is retried, the journal
+    returns recorded generations for the same prompts in the recorded order, so the agent re-executes completed
+    steps against a fresh environment without calling the model again.
+
+    In replay mode the journal is read-only and a missing entry raises `TrajectoryReplayError`, so a recorded
+    trajectory can be re-driven without network access.
+    """
+
+    def __init__(self, journal_path: str, replay: bool = False):
+        self.journal_path = journal_path
+        self.replay = replay
+        self.user_prompt: Optional[str] = None
+        self._replay_queues: dict[str, deque] = defaultdict(deque)
+        self._load()
+        self._file = None if replay else open(journal_path, 'a')
+
+    @staticmethod
+    def get_key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f'{llm_string}\n{prompt}'.encode()).hexdigest()
+
+    @staticmethod
+    def get_env_key(method: str, args: dict[str, Any]) -> str:
+        return hashlib.sha256(f'{method}\n{json.dumps(args, sort_keys=True)}'.encode()).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.journal_path):
+            return
+        valid_size = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    entry = None
+                if entry is None or not line.endswith(b'\n'):
+                    # The last entry may be partially written if the process was killed
+                    break
+                valid_size += len(line)
+                if entry['type'] == 'input':
+                    self.user_prompt = entry['user_prompt']
+                elif entry['type'] == 'llm':
+                    self._replay_queues[entry['key']].append(entry['generations'])
+                elif entry['type'] == 'env':
+                    self._replay_queues[entry['key']].append(entry['output'])
+        if not self.replay and valid_size != os.path.getsize(self.journal_path):
+            os.truncate(self.journal_path, valid_size)
+
+    def _append(self, entry: dict[str, Any]):
+        if self.replay:
+            return
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _pop(self, key: str) -> Optional[Any]:
+        replay_queue = self._replay_queues.get(key)
+        if not replay_queue:
+            return None
+        return replay_queue.popleft()
+
+    def record_input(self, user_prompt: str):
+        if self.user_prompt is None:
+            self.user_prompt = user_prompt
+            self._append({'type': 'input', 'user_prompt': user_prompt})
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        generations = self._pop(self.get_key(prompt, llm_string))
+        if generations is None:
+            if self.replay:
+                raise TrajectoryReplayError(f"No recorded generation for the prompt in {self.journal_path}")
+            return None
+        return [loads(generation) for generation in generations]
+
+    def record(self, prompt: str, llm_string: str, generations: RETURN_VAL_TYPE):
+        self._append({
+            'type': 'llm',
+            'key': self.get_key(prompt, llm_string),
+            'generations': [dumps(generation) for generation in generations],
+        })
+
+    def lookup_env_call(self, method: str, args: dict[str, Any]) -> Any:
+        key = self.get_env_key(method, args)
+        replay_queue = self._replay_queues.get(key)
+        if not replay_queue:
+            raise TrajectoryReplayError(f"No recorded env call {method}({args}) in {self.journal_path}")
+        return replay_queue.popleft()
+
+    def record_env_call(self, method: str, args: dict[str, Any], output: Any):
+        key = self.get_env_key(method, args)
+        # Calls re-executed while resuming a retried run are already in the journal
+        if self._pop(key) is not None:
+            return
+        self._append({'type': 'env', 'key': key, 'method': method, 'args': args, 'output': output})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def get_current_journal() -> Optional[TrajectoryJournal]:
+    return _current_journal.get()
+
+
+class JournalCache(BaseCache):
+    """LangChain cache which routes chat model calls to the journal of the current agent run, if any.
+
+    Misses are delegated to the optional `fallback` cache, generations served by it are journaled as well.
+    """
+
+    def __init__(self, fallback: Optional[BaseCache] = None):
+        self._fallback = fallback
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        journal = _current_journal.get()
+        if journal is not None:
+            generations = journal.lookup(prompt, llm_string)
+            if generations is not None:
+                return generations
+        if self._fallback is None:
+            return None
+        generations = self._fallback.lookup(prompt, llm_string)
+        if generations is not None and journal is not None:
+            journal.record(prompt, llm_string, generations)
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        journal = _current_journal.get()
+        if journal is not None:
+            journal.record(prompt, llm_string, return_val)
+        if self._fallback is not None:
+            self._fallback.update(prompt, llm_string, return_val)
+
+    # Journal operations are cheap and have to see the context of the calling task, so they are not run in executor
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        return self.lookup(prompt, llm_string)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: Sequence[Any]) -> None:
+        self.update(prompt, llm_string, return_val)
+
+    def clear(self, **kwargs: Any) -> None:
+        pass
+
+
+@contextmanager
+def trajectory_journal(journal_path: str, replay: bool = False) -> Iterator[TrajectoryJournal]:
+    journal = TrajectoryJournal(journal_path, replay)
+    token = _current_journal.set(journal)
+    try:
+        yield journal
+    finally:
+        _current_journal.reset(token)
+        journal.close()
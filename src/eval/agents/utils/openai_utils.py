@@ -1,26 +1,57 @@
 import os
+from typing import Any, AsyncIterator, Optional
 
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
 from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
 from langchain_openai import ChatOpenAI
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletion
+from pydantic.v1 import PrivateAttr
 from tenacity import wait_random_exponential, stop_after_attempt, retry
 
+from src.eval.agents.utils.cache_utils import ResponseCache, get_langchain_cache, get_response_cache
+from src.eval.agents.utils.journal_utils import JournalCache
+from src.eval.agents.utils.rate_limit_utils import Priority, get_rate_limiter
 from src.eval.agents.utils.tokenization_utils import TokenizationUtils
 
 DEFAULT_MODEL = "gpt-4-1106-preview"
 
 
+async def chat_completion_request(client: AsyncOpenAI, messages: list[dict[str, str]], temperature=1.0, model: str = DEFAULT_MODEL, priority: Priority = Priority.JUDGE, **model_kwargs) -> ChatCompletion:
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return await _chat_completion_request(client, messages, temperature, model, priority, **model_kwargs)
+
+    key = ResponseCache.get_key(model=model, messages=messages, temperature=temperature, **model_kwargs)
+    cached_response = response_cache.get(key)
+    if cached_response is not None:
+        return ChatCompletion.model_validate_json(cached_response)
+
+    response = await _chat_completion_request(client, messages, temperature, model, priority, **model_kwargs)
+    if isinstance(response, ChatCompletion):
+        response_cache.put(key, response.model_dump_json())
+    return response
+
+
 @retry(wait=wait_random_exponential(multiplier=1, max=40), stop=stop_after_attempt(3))
-async def chat_completion_request(client: AsyncOpenAI, messages: list[dict[str, str]], temperature=1.0, model: str = DEFAULT_MODEL, **model_kwargs) -> ChatCompletion:
-    tokenization_utils = TokenizationUtils(model)
+async def _chat_completion_request(client: AsyncOpenAI, messages: list[dict[str, str]], temperature=1.0, model: str = DEFAULT_MODEL, priority: Priority = Priority.JUDGE, **model_kwargs) -> ChatCompletion:
+    tokenization_utils = TokenizationUtils.for_profile(model)
     try:
+        messages = tokenization_utils.truncate(messages)
+        rate_limiter = get_rate_limiter()
+        if rate_limiter is not None:
+            estimated_tokens = tokenization_utils.count_messages_tokens(messages)
+            await rate_limiter.acquire(estimated_tokens, priority)
         response = await client.chat.completions.create(
             model=model,
-            messages=tokenization_utils.truncate(messages),
+            messages=messages,
             temperature=temperature,
             **model_kwargs
         )
+        if rate_limiter is not None and response.usage is not None:
+            rate_limiter.adjust(estimated_tokens, response.usage.total_tokens)
         return response
     except Exception as e:
         print("Unable to generate chat completion response")
@@ -28,6 +59,58 @@ async def chat_completion_request(client: AsyncOpenAI, messages: list[dict[str,
         return e
 
 
-def create_chat(model_name: str, temperature: int, model_kwargs: dict) -> BaseChatModel:
-    return ChatOpenAI(model_name=model_name, openai_api_key=os.environ["OPENAI_API_KEY"],
-                      temperature=temperature, model_kwargs=model_kwargs)
+class RateLimitedChatOpenAI(ChatOpenAI):
+    """ChatOpenAI which waits for the rate limiter only when a request is actually sent.
+
+    LangChain checks the cache before calling `_agenerate` and `_astream`, so journal replays and cached
+    generations neither wait for nor spend the rate limit budget.
+    """
+
+    _priority: Priority = PrivateAttr(default=Priority.AGENT)
+
+    @classmethod
+    def lc_id(cls) -> list[str]:
+        # Cache and journal keys include the serialized model, so they are kept the same as for ChatOpenAI
+        return ChatOpenAI.lc_id()
+
+    def _estimate_tokens(self, messages: list[BaseMessage]) -> int:
+        try:
+            tokenization_utils = TokenizationUtils.for_profile(self.model_name)
+        except ValueError:
+            return 0
+        return sum(tokenization_utils.count_text_tokens(str(message.content)) for message in messages)
+
+    async def _acquire(self, messages: list[BaseMessage]) -> int:
+        rate_limiter = get_rate_limiter()
+        if rate_limiter is None:
+            return 0
+        estimated_tokens = self._estimate_tokens(messages)
+        await rate_limiter.acquire(estimated_tokens, self._priority)
+        return estimated_tokens
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        estimated_tokens = await self._acquire(messages)
+        result = await super()._agenerate(messages, stop, run_manager, **kwargs)
+        rate_limiter = get_rate_limiter()
+        token_usage = (result.llm_output or {}).get('token_usage', {})
+        if rate_limiter is not None and 'total_tokens' in token_usage:
+            rate_limiter.adjust(estimated_tokens, token_usage['total_tokens'])
+        return result
+
+    async def _astream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await self._acquire(messages)
+        async for chunk in super()._astream(messages, stop, run_manager, **kwargs):
+            yield chunk
+
+
+def create_chat(model_name: str, temperature: int, model_kwargs: dict,
+                priority: Priority = Priority.AGENT) -> BaseChatModel:
+    chat = RateLimitedChatOpenAI(model_name=model_name, openai_api_key=os.environ["OPENAI_API_KEY"],
+                                 temperature=temperature, model_kwargs=model_kwargs,
+                                 cache=JournalCache(fallback=get_langchain_cache()))
+    # Not a constructor argument, so the priority does not change cache keys
+    chat._priority = priority
+    return chat
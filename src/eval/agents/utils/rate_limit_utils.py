@@ -0,0 +1,139 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Optional
+
+OPENAI_RPM_LIMIT = 'OPENAI_RPM_LIMIT'  # Requests per minute, rate limiting is disabled if no limit is set
+OPENAI_TPM_LIMIT = 'OPENAI_TPM_LIMIT'  # Tokens per minute
+
+_current_tenant: ContextVar[str] = ContextVar('current_tenant', default='default')
+
+
+class Priority(IntEnum):
+    AGENT = 0
+    JUDGE = 1
+
+
+def set_rate_limit_tenant(tenant: str):
+    """Sets the tenant (e.g. project) of LLM calls made from the current task, tenants are served in turn."""
+    _current_tenant.set(tenant)
+
+
+class TokenBucket:
+
+    def __init__(self, limit_per_minute: int):
+        self.capacity = limit_per_minute
+        self._rate = limit_per_minute / 60
+        self._available = float(limit_per_minute)
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._available = min(self.capacity, self._available + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def time_until_available(self, amount: int) -> float:
+        self._refill()
+        # Requests larger than the whole bucket are let through once it is full
+        missing = min(amount, self.capacity) - self._available
+        return max(0.0, missing / self._rate)
+
+    def consume(self, amount: int):
+        self._refill()
+        # Might become negative when consumption is corrected with the actual usage
+        self._available -= amount
+
+
+class RateLimiter:
+    """Process-wide scheduler of LLM requests with requests and tokens per minute budgets.
+
+    Waiting requests are served by priority and round-robin across tenants within the same priority.
+    """
+
+    def __init__(self, rpm_limit: Optional[int], tpm_limit: Optional[int]):
+        self._requests = TokenBucket(rpm_limit) if rpm_limit else None
+        self._tokens = TokenBucket(tpm_limit) if tpm_limit else None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues: dict[Priority, OrderedDict[str, deque]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _bind(self, loop: asyncio.AbstractEventLoop):
+        # Waiters can not outlive their event loop, so the state is reset when a new loop is used
+        if self._loop is not loop:
+            self._loop = loop
+            self._queues = {priority: OrderedDict() for priority in Priority}
+            self._timer = None
+
+    async def acquire(self, tokens: int, priority: Priority = Priority.AGENT):
+        loop = asyncio.get_running_loop()
+        self._bind(loop)
+        future = loop.create_future()
+        self._queues[priority].setdefault(_current_tenant.get(), deque()).append((future, tokens))
+        self._dispatch()
+        await future
+
+    def adjust(self, estimated_tokens: int, actual_tokens: int):
+        """Corrects the tokens budget with the actual usage reported by the API."""
+        if self._tokens is not None:
+            self._tokens.consume(actual_tokens - estimated_tokens)
+
+    def _next_waiter(self) -> Optional[tuple[OrderedDict, str, deque]]:
+        for priority in Priority:
+            tenant_queues = self._queues[priority]
+            for tenant in list(tenant_queues.keys()):
+                waiters = tenant_queues[tenant]
+                while waiters and waiters[0][0].done():
+                    # Cancelled requests
+                    waiters.popleft()
+                if not waiters:
+                    del tenant_queues[tenant]
+                    continue
+                return tenant_queues, tenant, waiters
+        return None
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while (next_waiter := self._next_waiter()) is not None:
+            tenant_queues, tenant, waiters = next_waiter
+            future, tokens = waiters[0]
+            wait_time = max(
+                self._requests.time_until_available(1) if self._requests is not None else 0.0,
+                self._tokens.time_until_available(tokens) if self._tokens is not None else 0.0,
+            )
+            if wait_time > 0:
+                self._timer = self._loop.call_later(wait_time, self._dispatch)
+                return
+
+            waiters.popleft()
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                self._tokens.consume(tokens)
+            # Next request of the same priority is taken from another tenant
+            tenant_queues.move_to_end(tenant)
+            future.set_result(None)
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Returns the process-wide rate limiter configured by environment variables or None if it is disabled."""
+    global _rate_limiter
+    rpm_limit = os.environ.get(OPENAI_RPM_LIMIT)
+    tpm_limit = os.environ.get(OPENAI_TPM_LIMIT)
+    if not rpm_limit and not tpm_limit:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(int(rpm_limit) if rpm_limit else None,
+                                        int(tpm_limit) if tpm_limit else None)
+    return _rate_limiter
@@ -1,4 +1,8 @@
-from typing import List
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
 
 import anthropic
 import tiktoken
@@ -25,6 +29,12 @@ class TokenizationUtils:
         "gpt-4-1106-preview": {"model_provider": "openai", "model_name": "gpt-4", "context_size": 128000},
     }
 
+    MAX_CACHED_TOKEN_COUNTS = 4096
+
+    _registry: dict[str, 'TokenizationUtils'] = {}
+    _registry_lock = threading.Lock()
+    _registry_stats = {'hits': 0, 'misses': 0, 'load_time': {}}
+
     def __init__(self, profile_name: str):
         model_info = self.PROFILE_NAME_TO_PROVIDER_AND_MODEL.get(profile_name, None)
         if not model_info:
@@ -33,6 +43,8 @@ class TokenizationUtils:
         self._model_provider = model_info["model_provider"]
         self._model_name = model_info["model_name"]
         self._context_size = model_info["context_size"]
+        self._token_counts: OrderedDict[bytes, int] = OrderedDict()
+        self._token_counts_lock = threading.Lock()
 
         if self._model_provider == "openai":
             self._tokenizer = tiktoken.encoding_for_model(self._model_name)
@@ -41,20 +53,103 @@ class TokenizationUtils:
         elif self._model_provider == "huggingface":
             self._tokenizer = AutoTokenizer.from_pretrained(self._model_name)
 
+    @property
+    def context_size(self) -> int:
+        return self._context_size
+
+    @classmethod
+    def for_profile(cls, profile_name: str) -> 'TokenizationUtils':
+        """Returns a shared instance for a given profile, tokenizer is loaded only on the first request."""
+        with cls._registry_lock:
+            tokenization_utils = cls._registry.get(profile_name)
+            if tokenization_utils is not None:
+                cls._registry_stats['hits'] += 1
+                return tokenization_utils
+
+            cls._registry_stats['misses'] += 1
+            start_time = time.time()
+            tokenization_utils = cls(profile_name)
+            cls._registry_stats['load_time'][profile_name] = time.time() - start_time
+            cls._registry[profile_name] = tokenization_utils
+            return tokenization_utils
+
+    @classmethod
+    def warm_up(cls, profile_names: list[Optional[str]]):
+        """Loads tokenizers for given profiles in advance, unknown profiles are skipped."""
+        for profile_name in profile_names:
+            if profile_name in cls.PROFILE_NAME_TO_PROVIDER_AND_MODEL:
+                cls.for_profile(profile_name)
+
+    @classmethod
+    def get_registry_stats(cls) -> dict:
+        with cls._registry_lock:
+            return {
+                'hits': cls._registry_stats['hits'],
+                'misses': cls._registry_stats['misses'],
+                'load_time': dict(cls._registry_stats['load_time']),
+            }
+
     def _encode(self, text: str) -> List[str]:
         """Estimates the number of tokens for a given string."""
         if self._model_provider == "openai":
             return self._tokenizer.encode(text)
         if self._model_provider == "anthropic":
-            return self._tokenizer.encode(text)
+            return self._tokenizer.encode(text).ids
         if self._model_provider == "huggingface":
             return self._tokenizer(text).input_ids
 
         raise ValueError(f"{self._model_provider} is currently not supported for token estimation.")
 
+    def _decode(self, tokens: List[str]) -> str:
+        if self._model_provider in ("openai", "anthropic", "huggingface"):
+            return self._tokenizer.decode(tokens)
+
+        raise ValueError(f"{self._model_provider} is currently not supported for prompt truncation.")
+
+    @staticmethod
+    def _text_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def _get_cached_count(self, text: str) -> Optional[int]:
+        with self._token_counts_lock:
+            key = self._text_key(text)
+            count = self._token_counts.get(key)
+            if count is not None:
+                self._token_counts.move_to_end(key)
+            return count
+
+    def _cache_count(self, text: str, count: int):
+        with self._token_counts_lock:
+            self._token_counts[self._text_key(text)] = count
+            if len(self._token_counts) > self.MAX_CACHED_TOKEN_COUNTS:
+                self._token_counts.popitem(last=False)
+
     def count_text_tokens(self, text: str) -> int:
-        """Estimates the number of tokens for a given string."""
-        return len(self._encode(text))
+        """Estimates the number of tokens for a given string.
+
+        Counts are memoized by the text hash, as the same system prompts and history are counted on every call.
+        """
+        count = self._get_cached_count(text)
+        if count is None:
+            count = len(self._encode(text))
+            self._cache_count(text, count)
+        return count
+
+    def count_texts_tokens(self, texts: list[str], batch_size: int = 64) -> list[int]:
+        """Estimates the number of tokens for each of given strings using batch encoding."""
+        counts = []
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i + batch_size]
+            if self._model_provider == "openai":
+                encodings = self._tokenizer.encode_batch(batch, disallowed_special=())
+            elif self._model_provider == "anthropic":
+                encodings = [encoding.ids for encoding in self._tokenizer.encode_batch(batch)]
+            elif self._model_provider == "huggingface":
+                encodings = self._tokenizer(batch).input_ids
+            else:
+                raise ValueError(f"{self._model_provider} is currently not supported for token estimation.")
+            counts.extend(len(encoding) for encoding in encodings)
+        return counts
 
     def count_messages_tokens(self, messages: list[dict[str, str]]) -> int:
         """Estimates the number of tokens for a given list of messages.
@@ -79,23 +174,22 @@ class TokenizationUtils:
         return self.count_messages_tokens(messages) <= self._context_size
 
     def text_match_context_size(self, text: str) -> bool:
-        return self.text_match_context_size(text) <= self._context_size
+        return self.count_text_tokens(text) <= self._context_size
 
     def _truncate(self, text: str, max_num_tokens: int) -> str:
         """Truncates a given string to first `max_num_tokens` tokens.
 
-        1. Encodes string to a list of tokens via corresponding tokenizer.
+        1. Encodes string to a list of tokens via corresponding tokenizer, unless its count is already known to fit.
         2. Truncates the list of tokens to first `max_num_tokens` tokens.
-        3. Decodes list of tokens back to a string.
+        3. Decodes list of tokens back to a string only if it was actually truncated.
         """
-        if self._model_provider == "openai":
-            encoding = self._tokenizer.encode(text)[:max_num_tokens]
-            return self._tokenizer.decode(encoding)
-        if self._model_provider == "anthropic":
-            encoding = self._tokenizer.encode(text)[:max_num_tokens]
-            return self._tokenizer.decode(encoding)
-        if self._model_provider == "huggingface":
-            encoding = self._tokenizer(text).input_ids[:max_num_tokens]
-            return self._tokenizer.decode(encoding)
-
-        raise ValueError(f"{self._model_provider} is currently not supported for prompt truncation.")
+        max_num_tokens = max(max_num_tokens, 0)
+        count = self._get_cached_count(text)
+        if count is not None and count <= max_num_tokens:
+            return text
+
+        encoding = self._encode(text)
+        self._cache_count(text, len(encoding))
+        if len(encoding) <= max_num_tokens:
+            return text
+        return self._decode(encoding[:max_num_tokens])
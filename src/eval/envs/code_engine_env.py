@@ -1,6 +1,7 @@
 import asyncio
 import json
 import os
+from typing import Optional
 
 import aiohttp
 import docker
@@ -12,18 +13,20 @@ from src.template_generation.code_engine_env.code_engine_env_tools import code_e
 
 class CodeEngineEnv(BaseEnv):
 
-    def __init__(self, docker_image_name: str, docker_container_name: str, host: str, port: int):
+    def __init__(self, docker_image_name: str, docker_container_name: str, host: str, port: int,
+                 container_port: Optional[int] = None):
         self.docker_image_name = docker_image_name
         self.docker_container_name = docker_container_name
         self.host = host
         self.port = port
+        self.container_port = container_port if container_port is not None else port
         self.base_url = f'http://{self.host}:{self.port}'
         self.client = docker.from_env()
         self.init_params = None
 
     def _run_docker_container(self, local_path, container_path: str):
         volume_mapping = {local_path: {'bind': container_path, 'mode': 'rw'}}
-        port_mapping = {f'{self.port}': self.port}
+        port_mapping = {f'{self.container_port}': self.port}
         container = self.client.containers.run(
             image=self.docker_image_name,
             volumes=volume_mapping,
@@ -0,0 +1,40 @@
+from typing import Any
+
+from src.eval.agents.utils.journal_utils import get_current_journal
+from src.eval.envs.base_env import BaseEnv
+
+
+class RecordingEnv(BaseEnv):
+    """Wraps an env and records results of its calls to the journal of the current agent run."""
+
+    def __init__(self, env: BaseEnv):
+        self.env = env
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.env, name)
+
+    @staticmethod
+    def _record(method: str, args: dict, output: Any) -> Any:
+        journal = get_current_journal()
+        if journal is not None:
+            journal.record_env_call(method, args, output)
+        return output
+
+    async def init(self, init_params: dict) -> str:
+        return await self.env.init(init_params)
+
+    async def reset(self) -> str:
+        return self._record('reset', {}, await self.env.reset())
+
+    async def run_command(self, command_name: str, command_params: dict) -> str:
+        args = {'command_name': command_name, 'command_params': command_params}
+        return self._record('run_command', args, await self.env.run_command(command_name, command_params))
+
+    async def get_tools(self) -> list[dict]:
+        return self._record('get_tools', {}, await self.env.get_tools())
+
+    async def get_state(self) -> str:
+        return self._record('get_state', {}, await self.env.get_state())
+
+    async def shutdown(self):
+        await self.env.shutdown()
@@ -0,0 +1,31 @@
+from src.eval.agents.utils.journal_utils import get_current_journal, TrajectoryReplayError
+from src.eval.envs.base_env import BaseEnv
+
+
+class ReplayEnv(BaseEnv):
+    """Env which returns results recorded by `RecordingEnv` from the journal of the current agent run."""
+
+    @staticmethod
+    def _replay(method: str, args: dict):
+        journal = get_current_journal()
+        if journal is None:
+            raise TrajectoryReplayError("ReplayEnv can be used only inside of the trajectory journal")
+        return journal.lookup_env_call(method, args)
+
+    async def init(self, init_params: dict) -> str:
+        pass
+
+    async def reset(self) -> str:
+        return self._replay('reset', {})
+
+    async def run_command(self, command_name: str, command_params: dict) -> str:
+        return self._replay('run_command', {'command_name': command_name, 'command_params': command_params})
+
+    async def get_tools(self) -> list[dict]:
+        return self._replay('get_tools', {})
+
+    async def get_state(self) -> str:
+        return self._replay('get_state', {})
+
+    async def shutdown(self):
+        pass
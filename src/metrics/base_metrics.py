@@ -1,36 +1,147 @@
-from typing import Any
+import threading
+from typing import Any, Optional
 
 import evaluate
-from evaluate import load
+import sentence_transformers
+import torch
+from evaluate import EvaluationModule
 from sentence_transformers import SentenceTransformer
 from sentence_transformers.util import cos_sim
+from torch import Tensor
+
+from src.metrics.embedding_store import EmbeddingStore
+
+GTE_MODEL_NAME = 'thenlper/gte-large'
+
+
+class MetricEngine:
+    """Loads metric backends on first use and keeps them resident, so repeated metric calls do not reload models."""
+
+    def __init__(self, batch_size: int = 32, embedding_store_path: Optional[str] = None):
+        self.batch_size = batch_size
+        self._modules: dict[str, EvaluationModule] = {}
+        self._gte_model: Optional[SentenceTransformer] = None
+        self._embedding_store = None
+        self._load_lock = threading.Lock()
+        # Evaluation modules keep per-call state and reseed the global numpy RNG in `compute`,
+        # so computations of all modules are serialized between threads
+        self._compute_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        if embedding_store_path is not None:
+            model_id = f'{GTE_MODEL_NAME}@sentence-transformers-{sentence_transformers.__version__}'
+            self._embedding_store = EmbeddingStore(embedding_store_path, model_id)
+
+    def _get_module(self, metric: str) -> EvaluationModule:
+        with self._load_lock:
+            if metric not in self._modules:
+                self._modules[metric] = evaluate.load(metric)
+            return self._modules[metric]
+
+    @property
+    def gte_model(self) -> SentenceTransformer:
+        with self._load_lock:
+            if self._gte_model is None:
+                self._gte_model = SentenceTransformer(GTE_MODEL_NAME)
+            return self._gte_model
+
+    def _compute_module(self, metric: str, **kwargs) -> dict[str, Any]:
+        module = self._get_module(metric)
+        with self._compute_lock:
+            return module.compute(**kwargs)
+
+    def _encode(self, texts: list[str], **kwargs):
+        gte_model = self.gte_model
+        with self._encode_lock:
+            return gte_model.encode(texts, batch_size=self.batch_size, **kwargs)
+
+    def embed(self, texts: list[str]) -> Tensor:
+        if len(texts) == 0:
+            return torch.empty((0, self.gte_model.get_sentence_embedding_dimension()))
+        if self._embedding_store is None:
+            return self._encode(texts, convert_to_tensor=True)
+
+        # Only texts which were never embedded before are passed to the model
+        keys = [EmbeddingStore.get_key(text) for text in texts]
+        missing = {key: text for key, text in zip(keys, texts) if key not in self._embedding_store}
+        if len(missing) > 0:
+            vectors = self._encode(list(missing.values()), convert_to_numpy=True)
+            self._embedding_store.add(list(missing.keys()), vectors)
+        return torch.from_numpy(self._embedding_store.get(keys))
+
+    def gte_similarity(self, predictions: list[str], references: list[str]) -> Tensor:
+        embeddings = self.embed(predictions + references)
+        return cos_sim(embeddings[:len(predictions)], embeddings[len(predictions):])
+
+    def compute(self, predictions: list[str], references: list[str], metrics: list[str]) -> dict[str, Any]:
+        result = {}
+        for metric in metrics:
+            if metric == "chrf":
+                result["chrf"] = self._compute_module("chrf", predictions=predictions, references=references)
+            elif metric == "rouge":
+                result["rouge"] = self._compute_module("rouge", predictions=predictions, references=references)
+            elif metric == "bertscore":
+                # Module keeps the scorer model loaded between compute calls
+                result["bertscore"] = self._compute_module(
+                    "bertscore", predictions=predictions, references=references, lang='en', batch_size=self.batch_size)
+            elif metric == "bleu":
+                # TODO: Use "k4black/codebleu" for code
+                result["bleu"] = self._compute_module("bleu", predictions=predictions, references=references)
+            elif metric == "gte":
+                result["gte"] = {"gte": self.gte_similarity(predictions, references)}
+            else:
+                raise ValueError(f"Metrics {metric} is not supported")
+
+        return result
+
+    def compute_pairs(self, predictions: list[str], references: list[str], metrics: list[str]) \
+            -> list[dict[str, Any]]:
+        """Computes metrics of each (prediction, reference) pair separately, model metrics are run in batches."""
+        results = [{} for _ in predictions]
+        if len(results) == 0:
+            return results
+        for metric in metrics:
+            if metric == "chrf" or metric == "bleu":
+                # Both are corpus-level metrics, so a batched call would not give per-pair scores
+                for result, prediction, reference in zip(results, predictions, references):
+                    result[metric] = self._compute_module(metric, predictions=[prediction], references=[reference])
+            elif metric == "rouge":
+                scores = self._compute_module("rouge", predictions=predictions, references=references,
+                                              use_aggregator=False)
+                for i, result in enumerate(results):
+                    result["rouge"] = {key: values[i] for key, values in scores.items()}
+            elif metric == "bertscore":
+                scores = self._compute_module(
+                    "bertscore", predictions=predictions, references=references, lang='en', batch_size=self.batch_size)
+                for i, result in enumerate(results):
+                    result["bertscore"] = {key: [values[i]] for key, values in scores.items() if key != 'hashcode'}
+            elif metric == "gte":
+                embeddings = self.embed(predictions + references)
+                scores = torch.nn.functional.cosine_similarity(embeddings[:len(predictions)],
+                                                               embeddings[len(predictions):])
+                for i, result in enumerate(results):
+                    result["gte"] = {"gte": scores[i]}
+            else:
+                raise ValueError(f"Metrics {metric} is not supported")
+
+        return results
+
+
+_metric_engine: Optional[MetricEngine] = None
+
+
+def init_metric_engine(embedding_store_path: Optional[str] = None) -> MetricEngine:
+    """Configures the shared metric engine, embeddings are persisted in `embedding_store_path` if it is set."""
+    global _metric_engine
+    _metric_engine = MetricEngine(embedding_store_path=embedding_store_path)
+    return _metric_engine
+
+
+def get_metric_engine() -> MetricEngine:
+    """Returns the metric engine shared by all metric computations of the process."""
+    if _metric_engine is None:
+        return init_metric_engine()
+    return _metric_engine
 
 
 def calc_base_metrics(predictions: list[str], references: list[str], metrics: list[str]) -> dict[str, Any]:
-    result = {}
-    for metric in metrics:
-        if metric == "chrf":
-            chrf = evaluate.load("chrf")
-            chrf_results = chrf.compute(predictions=predictions, references=references)
-            result["chrf"] = chrf_results
-        elif metric == "rouge":
-            rouge = evaluate.load("rouge")
-            rouge_results = rouge.compute(predictions=predictions, references=references)
-            result["rouge"] = rouge_results
-        elif metric == "bertscore":
-            bertscore = load("bertscore")
-            bertscore_results = bertscore.compute(predictions=predictions, references=references, lang='en')
-            result["bertscore"] = bertscore_results
-        elif metric == "bleu":
-            # TODO: Use "k4black/codebleu" for code
-            bleu = load("bleu")
-            bleu_results = bleu.compute(predictions=predictions, references=references)
-            result["bleu"] = bleu_results
-        elif metric == "gte":
-            model = SentenceTransformer('thenlper/gte-large')
-            embeddings = model.encode(predictions + references)
-            result["gte"] = {"gte": cos_sim(embeddings[:len(predictions)], embeddings[len(predictions):])}
-        else:
-            raise ValueError(f"Metrics {metric} is not supported")
-
-    return result
+    return get_metric_engine().compute(predictions, references, metrics)
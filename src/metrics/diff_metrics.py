@@ -3,7 +3,11 @@ from openai import AsyncOpenAI
 from src.eval.agents.utils.openai_utils import chat_completion_request
 from src.metrics.metrics_prompts import get_gen_golden_diff_metric_prompt, \
     get_gen_vanilla_golden_diff_metric_prompt
-from src.utils.git_utils import get_diff_between_directories
+from src.utils.diff_utils import diff_directories, get_diff_between_directories
+
+
+def gen_golden_diff_stats(gen_project_path: str, golden_project_path: str) -> dict[str, int]:
+    return diff_directories(golden_project_path, gen_project_path).get_stats()
 
 
 async def gen_golden_diff_metric(gen_project_path: str, golden_project_path: str) -> tuple[str, int]:
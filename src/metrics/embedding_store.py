@@ -0,0 +1,136 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+
+class EmbeddingStore:
+    """Content-addressed on-disk store of embeddings backed by a memory-mapped float32 matrix.
+
+    Vectors are appended to `vectors.f32`, the content hash of row `i` is the `i`-th line of `index.txt`.
+    The store is dropped when it was built by another model, as recorded in `meta.json`.
+    Appends are serialized with a file lock, so the store can be shared by worker processes.
+    """
+
+    def __init__(self, store_path: str, model_id: str):
+        self.store_path = store_path
+        self.model_id = model_id
+        self._meta_path = os.path.join(store_path, 'meta.json')
+        self._index_path = os.path.join(store_path, 'index.txt')
+        self._vectors_path = os.path.join(store_path, 'vectors.f32')
+        self._lock_path = os.path.join(store_path, '.lock')
+        self._rows: dict[str, int] = {}
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        os.makedirs(store_path, exist_ok=True)
+        with self._locked():
+            self._load()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(self._lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def get_key(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _reset(self):
+        for path in [self._meta_path, self._index_path, self._vectors_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        with open(self._meta_path, 'w') as f:
+            json.dump({'model_id': self.model_id, 'dim': None}, f)
+
+    def _load(self):
+        meta = None
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+        if meta is None or meta['model_id'] != self.model_id:
+            self._reset()
+            return
+        self._dim = meta['dim']
+        if self._dim is None or not os.path.exists(self._index_path):
+            return
+
+        with open(self._index_path) as f:
+            keys = [line.rstrip('\n') for line in f if line.endswith('\n')]
+        vectors_count = os.path.getsize(self._vectors_path) // (self._dim * 4) \
+            if os.path.exists(self._vectors_path) else 0
+        # Vectors are written before their keys, so an interrupted append leaves only trailing vectors or key parts
+        rows_count = min(len(keys), vectors_count)
+        with open(self._index_path, 'w') as f:
+            f.writelines(f'{key}\n' for key in keys[:rows_count])
+        if os.path.exists(self._vectors_path):
+            os.truncate(self._vectors_path, rows_count * self._dim * 4)
+        self._rows = {key: i for i, key in enumerate(keys[:rows_count])}
+        self._map_vectors()
+
+    def _sync(self):
+        """Reads rows appended by other processes since the store was loaded."""
+        if self._dim is None:
+            with open(self._meta_path) as f:
+                self._dim = json.load(f)['dim']
+        if self._dim is None or not os.path.exists(self._index_path):
+            return
+        with open(self._index_path) as f:
+            keys = [line.rstrip('\n') for line in f]
+        for key in keys[len(self._rows):]:
+            self._rows[key] = len(self._rows)
+
+    def _map_vectors(self):
+        if len(self._rows) == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(len(self._rows), self._dim))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get(self, keys: list[str]) -> np.ndarray:
+        """Returns stored vectors of the given keys as an in-memory matrix, all keys have to be present."""
+        if len(keys) == 0:
+            # Vectors are not mapped while the store is empty
+            return np.empty((0, self._dim or 0), dtype=np.float32)
+        with self._lock:
+            return np.asarray(self._vectors[[self._rows[key] for key in keys]])
+
+    def add(self, keys: list[str], vectors: np.ndarray):
+        with self._locked():
+            self._sync()
+            self._add(keys, vectors)
+            self._map_vectors()
+
+    def _add(self, keys: list[str], vectors: np.ndarray):
+        new_rows = {}
+        for i, key in enumerate(keys):
+            if key not in self._rows and key not in new_rows:
+                new_rows[key] = i
+        if len(new_rows) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors[list(new_rows.values())], dtype=np.float32)
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+            with open(self._meta_path, 'w') as f:
+                json.dump({'model_id': self.model_id, 'dim': self._dim}, f)
+
+        with open(self._vectors_path, 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(self._index_path, 'a') as f:
+            for key in new_rows:
+                self._rows[key] = len(self._rows)
+                f.write(f'{key}\n')
@@ -1,34 +1,36 @@
 import os
-from typing import Any
+from typing import Any, Union
 
+from src.utils.project_snapshot import ProjectSnapshot
 
-def calc_files_metrics(project_path: str) -> dict:
+
+def calc_files_metrics(project: Union[str, ProjectSnapshot]) -> dict:
+    project = ProjectSnapshot.of(project)
+    root_dir = project.dirs[0]
     files_metrics = {
         'files_count': 0,
         'empty_files_count': 0,
         'dirs_count': 0,
         'empty_dirs_count': 0,
         'file_tree_depth': 0,
-        'has_root_dir': len(os.listdir(project_path)) == 1,
+        'has_root_dir': len(root_dir.dir_names) + len(root_dir.files) == 1,
     }
 
-    for dir, subdirs, files in os.walk(project_path):
-        if '.git' in dir:
+    for snapshot_dir in project.dirs:
+        if '.git' in snapshot_dir.path:
             continue
-        depth = dir.count(os.path.sep) - project_path.count(os.path.sep)
-        if depth > files_metrics['file_tree_depth']:
-            files_metrics['file_tree_depth'] = depth
+        if snapshot_dir.depth > files_metrics['file_tree_depth']:
+            files_metrics['file_tree_depth'] = snapshot_dir.depth
         files_metrics['dirs_count'] += 1
-        if len(subdirs) == 0 and len(files) == 0:
-            print(f'Empty dir: {dir}')
+        if len(snapshot_dir.dir_names) == 0 and len(snapshot_dir.files) == 0:
+            print(f'Empty dir: {snapshot_dir.path}')
             files_metrics['empty_dirs_count'] += 1
 
-        for filename in files:
+        for file in snapshot_dir.files:
             files_metrics['files_count'] += 1
-            if filename == '__init__.py':
+            if file.name == '__init__.py':
                 continue
-            file_path = os.path.join(dir, filename)
-            if os.path.getsize(file_path) == 0:
+            if file.size == 0:
                 files_metrics['empty_files_count'] += 1
 
     return files_metrics
@@ -42,10 +44,11 @@ def empty_directories_count(project_path: str):
     return empty_count
 
 
-def get_files_metrics(gen_project_path: str, golden_project_path: str) -> dict[str, Any]:
+def get_files_metrics(gen_project: Union[str, ProjectSnapshot], golden_project: Union[str, ProjectSnapshot]) \
+        -> dict[str, Any]:
     files_metrics = {}
-    for pref, project_path in [('gen', gen_project_path), ('golden', golden_project_path)]:
-        file_metrics = calc_files_metrics(project_path)
+    for pref, project in [('gen', gen_project), ('golden', golden_project)]:
+        file_metrics = calc_files_metrics(project)
         for k, v in file_metrics.items():
             files_metrics[f'{pref}_{k}'] = v
 
@@ -1,64 +1,87 @@
-from typing import Any
+from typing import Any, Mapping, Union
 
 import numpy as np
 import torch
 
-from src.metrics.base_metrics import calc_base_metrics
+from src.metrics.base_metrics import get_metric_engine
+from src.utils.project_snapshot import ProjectSnapshot
 from src.utils.project_utils import get_project_file_tree_as_dict
 
 
-def gen_golden_content_metrics(gen_project_path: str, golden_project_path: str) -> dict[str, Any]:
-    gen_dict = get_project_file_tree_as_dict(gen_project_path)
-    golden_dict = get_project_file_tree_as_dict(golden_project_path)
-
-    def concat_code(tree_dict: dict[str, str]) -> str:
-        concatenated_code = ""
-        for file, code in tree_dict.items():
-            concatenated_code += code
-        return concatenated_code
-
-    predictions = concat_code(gen_dict)
-    references = concat_code(golden_dict)
-
-    if len(predictions) == 0 or len(references) == 0:
-        return {
-            "bleu": None,
-            "rouge1": None,
-            "rouge2": None,
-            "rougeL": None,
-            "rougeLsum": None,
-            "chrf": None,
-            "bertscoref1": None,
-            "gte": None,
-        }
-
-    metrics = calc_base_metrics([predictions], [references], ["bleu", "rouge", "chrf", "bertscore", "gte"])
-    return {
-        "bleu": metrics["bleu"]["bleu"],
-        "rouge1": metrics["rouge"]["rouge1"],
-        "rouge2": metrics["rouge"]["rouge2"],
-        "rougeL": metrics["rouge"]["rougeL"],
-        "rougeLsum": metrics["rouge"]["rougeLsum"],
-        "chrf": metrics["chrf"]["score"],
-        "bertscoref1": metrics["bertscore"]["f1"][0],
-        "gte": metrics["gte"]["gte"].item(),
-    }
+CONTENT_METRICS = ["bleu", "rouge", "chrf", "bertscore", "gte"]
+
+
+def _concat_code(tree_dict: Mapping[str, str]) -> str:
+    return "".join(tree_dict.values())
+
+
+def gen_golden_content_metrics_batch(projects: list[tuple[Union[str, ProjectSnapshot], Union[str, ProjectSnapshot]]],
+                                     batch_size: int = 32) -> list[dict[str, Any]]:
+    """Computes content metrics of (gen project, golden project) pairs given as paths or snapshots.
+
+    Projects are processed by `batch_size` pairs at once, so only contents of a single batch are kept in memory.
+    """
+    results = []
+    for batch_start in range(0, len(projects), batch_size):
+        batch_projects = projects[batch_start:batch_start + batch_size]
+        batch_results = [None] * len(batch_projects)
+        predictions, references, batch_indices = [], [], []
+        for i, (gen_project, golden_project) in enumerate(batch_projects):
+            prediction = _concat_code(get_project_file_tree_as_dict(gen_project))
+            reference = _concat_code(get_project_file_tree_as_dict(golden_project))
+            if len(prediction) == 0 or len(reference) == 0:
+                batch_results[i] = {
+                    "bleu": None,
+                    "rouge1": None,
+                    "rouge2": None,
+                    "rougeL": None,
+                    "rougeLsum": None,
+                    "chrf": None,
+                    "bertscoref1": None,
+                    "gte": None,
+                }
+                continue
+            predictions.append(prediction)
+            references.append(reference)
+            batch_indices.append(i)
+
+        pairs_metrics = get_metric_engine().compute_pairs(predictions, references, CONTENT_METRICS)
+        for i, metrics in zip(batch_indices, pairs_metrics):
+            batch_results[i] = {
+                "bleu": metrics["bleu"]["bleu"],
+                "rouge1": metrics["rouge"]["rouge1"],
+                "rouge2": metrics["rouge"]["rouge2"],
+                "rougeL": metrics["rouge"]["rougeL"],
+                "rougeLsum": metrics["rouge"]["rougeLsum"],
+                "chrf": metrics["chrf"]["score"],
+                "bertscoref1": metrics["bertscore"]["f1"][0],
+                "gte": metrics["gte"]["gte"].item(),
+            }
+        results.extend(batch_results)
+
+    return results
+
+
+def gen_golden_content_metrics(gen_project: Union[str, ProjectSnapshot], golden_project: Union[str, ProjectSnapshot]) \
+        -> dict[str, Any]:
+    return gen_golden_content_metrics_batch([(gen_project, golden_project)])[0]
 
 
-def gen_golden_content_metric_by_files(gen_project_path: str, golden_project_path: str, metrics: str = "gte") \
+def gen_golden_content_metric_by_files(gen_project: Union[str, ProjectSnapshot],
+                                       golden_project: Union[str, ProjectSnapshot], metrics: str = "gte") \
         -> dict[str, Any]:
-    gen_dict = get_project_file_tree_as_dict(gen_project_path)
-    golden_dict = get_project_file_tree_as_dict(golden_project_path)
+    gen_dict = get_project_file_tree_as_dict(gen_project)
+    golden_dict = get_project_file_tree_as_dict(golden_project)
 
     golden_contents = [file + content for file, content in golden_dict.items()]
-    golden_files = [file for file, content in golden_dict.items()]
+    golden_files = list(golden_dict)
     golden_files_count = len(golden_contents)
 
     gen_contents = [file + content for file, content in gen_dict.items()]
-    gen_files = [file for file, content in gen_dict.items()]
+    gen_files = list(gen_dict)
 
     metric = 'gte'
-    metrics = calc_base_metrics(gen_contents, golden_contents, [metric])[metric][metric]
+    metrics = get_metric_engine().gte_similarity(gen_contents, golden_contents)
     best_match = torch.argmax(metrics, dim=1).tolist()
 
     best_metrics = []
@@ -73,12 +96,3 @@ def gen_golden_content_metric_by_files(gen_project_path: str, golden_project_pat
         'uncovered_golden': (golden_files_count - len(golden_selected_files)) / golden_files_count
     }
 
-
-def get_closest_project_index(description: str, other_descriptions: list[str]):
-    metric = 'gte'
-    metrics = \
-    calc_base_metrics([description], [d if d is not None else "" for d in other_descriptions], [metric])[metric][
-        metric]
-    best_match = torch.argmax(metrics, dim=1).tolist()[0]
-
-    return best_match
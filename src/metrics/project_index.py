@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+from datasets import Dataset
+
+from src.metrics.base_metrics import get_metric_engine
+
+
+class ProjectDescriptionIndex:
+    """Nearest-neighbour index over `gpt_description` embeddings of a dataset split.
+
+    Embeddings are normalized, so the gte cosine similarity of a project to all others is a single matrix-vector
+    product. The index is built on the first query and persisted in `index_path`, it is rebuilt when the
+    descriptions of the split change.
+    """
+
+    def __init__(self, projects: Dataset, index_path: Optional[str] = None):
+        self.projects = projects
+        self.index_path = index_path
+        self._rows: Optional[dict[int, int]] = None
+        self._embeddings: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _load_or_build(self):
+        ids = list(self.projects['id'])
+        descriptions = [d if d is not None else "" for d in self.projects['gpt_description']]
+        digest = hashlib.sha256(json.dumps([ids, descriptions]).encode()).hexdigest()
+
+        if self.index_path is not None and os.path.exists(self.index_path):
+            index = np.load(self.index_path)
+            if str(index['digest']) == digest:
+                self._embeddings = index['embeddings']
+                self._rows = {project_id: i for i, project_id in enumerate(ids)}
+                return
+
+        embeddings = get_metric_engine().embed(descriptions).cpu().numpy().astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        self._embeddings = embeddings / np.maximum(norms, 1e-12)
+
+        if self.index_path is not None:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_index_path = f'{self.index_path}.tmp.npz'
+            np.savez(tmp_index_path, embeddings=self._embeddings, digest=np.array(digest))
+            os.replace(tmp_index_path, self.index_path)
+        self._rows = {project_id: i for i, project_id in enumerate(ids)}
+
+    def load(self):
+        """Loads or builds the index if it is not loaded yet, may take long, so it is not called in the event loop."""
+        with self._lock:
+            if self._rows is None:
+                self._load_or_build()
+
+    def get_row(self, project_id: int) -> int:
+        self.load()
+        return self._rows[project_id]
+
+    def get_closest_rows(self, project_id: int, k: int = 1) -> list[int]:
+        """Returns dataset rows of `k` projects with the most similar descriptions, the project itself excluded."""
+        row = self.get_row(project_id)
+        scores = self._embeddings @ self._embeddings[row]
+        scores[row] = -np.inf
+        k = min(k, len(scores) - 1)
+        if k <= 0:
+            return []
+        top_rows = np.argpartition(-scores, k - 1)[:k]
+        return top_rows[np.argsort(-scores[top_rows])].tolist()
@@ -1,8 +1,24 @@
 import json
 import os
-import shutil
-import subprocess
+import re
+import time
 from collections import defaultdict
+from typing import Any, Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.metrics.qodana_runner import QodanaRunner, run_qodana_cold, stage_project
+
+QODANA_PROBLEMS_SCHEMA = pa.schema([
+    ('inspection', pa.string()),
+    ('type', pa.string()),
+    ('severity', pa.string()),
+    ('category', pa.string()),
+    ('file', pa.string()),
+    ('line', pa.int64()),
+    ('comment', pa.string()),
+])
 
 
 def get_subitems(path, exclude_items = None):
@@ -21,44 +37,95 @@ def get_subitems(path, exclude_items = None):
     return subdirs, subfiles
 
 
-def get_qodana_metrics(project_path: str, qodana_project_path: str, language: str) -> dict:
-    if os.path.exists(qodana_project_path):
-        shutil.rmtree(qodana_project_path)
-    os.makedirs(qodana_project_path)
+def iter_qodana_problems(results_json_path: str, chunk_size: int = 1 << 20) -> Iterator[dict[str, Any]]:
+    """Yields items of `listProblem` one by one without loading the whole report into memory."""
+    decoder = json.JSONDecoder()
+    with open(results_json_path) as f:
+        buffer = ''
+        # Skip everything before the problems array
+        while True:
+            array_start = re.search(r'"listProblem"\s*:\s*\[', buffer)
+            if array_start is not None:
+                buffer = buffer[array_start.end():]
+                break
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                problem, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The next problem is not read completely yet
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield problem
 
+
+def write_problems_parquet(problems: Iterator[dict[str, Any]], problems_path: str, batch_size: int = 10000) \
+        -> dict[str, int]:
+    """Writes problems into a parquet file with a row per problem, returns problem counts by inspection name."""
+    os.makedirs(os.path.dirname(problems_path), exist_ok=True)
+    problems_by_name_count = defaultdict(int)
+    tmp_problems_path = f'{problems_path}.tmp'
+    with pq.ParquetWriter(tmp_problems_path, QODANA_PROBLEMS_SCHEMA) as writer:
+        rows = []
+        for problem in problems:
+            source = (problem.get("sources") or [{}])[0]
+            row = {
+                'inspection': problem["attributes"]["inspectionName"],
+                'type': problem.get("type"),
+                'severity': problem.get("severity"),
+                'category': problem.get("category"),
+                'file': source.get("path"),
+                'line': source.get("line"),
+                'comment': problem.get("comment"),
+            }
+            problems_by_name_count[row['inspection']] += 1
+            rows.append(row)
+            if len(rows) == batch_size:
+                writer.write_table(pa.Table.from_pylist(rows, schema=QODANA_PROBLEMS_SCHEMA))
+                rows = []
+        writer.write_table(pa.Table.from_pylist(rows, schema=QODANA_PROBLEMS_SCHEMA))
+    os.replace(tmp_problems_path, problems_path)
+    return dict(problems_by_name_count)
+
+
+def get_qodana_metrics(project_path: str, qodana_project_path: str, language: str, problems_path: str,
+                       logs_path: str, runner: Optional[QodanaRunner] = None) -> dict:
     # Sometimes root directory is subdirectory
     subdirs, subfiles = get_subitems(project_path, ['bash'])
     if len(subdirs) == 1 and len(subfiles) == 0:
         project_path = subdirs[0]
 
-    print(f"Coping files from {project_path} to {qodana_project_path}...")
-    for filename in os.listdir(project_path):
-        src_file_path = os.path.join(project_path, filename)
-        if os.path.isfile(src_file_path):
-            shutil.copy(src_file_path, qodana_project_path)
-        else:
-            dst_file_path = os.path.join(qodana_project_path, filename)
-            shutil.copytree(src_file_path, dst_file_path)
+    print(f"Staging files from {project_path} to {qodana_project_path}...")
+    stage_project(project_path, qodana_project_path)
     print(f"Running Qodana...")
-    if language == 'py':
-        qodana_command = ['docker', 'run',
-                          '-v', f"{qodana_project_path}:/data/project/",
-                          '-v', f"{os.path.join(qodana_project_path, '.qodana')}:/data/results/",
-                          '-e', f"QODANA_TOKEN={os.environ.get('QODANA_TOKEN')}",
-                          'jetbrains/qodana-python']
+    start_time = time.monotonic()
+    if runner is not None:
+        returncode, logs, error = runner.run(qodana_project_path)
     else:
-        qodana_command = ['docker', 'run',
-                          '-v', f"{qodana_project_path}:/data/project/",
-                          '-v', f"{os.path.join(qodana_project_path, '.qodana')}:/data/results/",
-                          '-e', f"QODANA_TOKEN={os.environ.get('QODANA_TOKEN')}",
-                          'jetbrains/qodana-jvm']
-
-    process = subprocess.run(qodana_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    logs = process.stdout.decode()
+        returncode, logs, error = run_qodana_cold(qodana_project_path, language)
     print(f"\nQodana CLI logs:\n{logs}")
 
     qodana_metrics = {}
-    qodana_metrics['logs'] = logs
+    # Kept to compare warm and cold runs
+    qodana_metrics['qodana_mode'] = 'warm' if runner is not None else 'cold'
+    qodana_metrics['qodana_time'] = time.monotonic() - start_time
+    os.makedirs(os.path.dirname(logs_path), exist_ok=True)
+    with open(logs_path, 'w') as f:
+        f.write(logs)
+    qodana_metrics['logs_path'] = logs_path
 
     open_in_ide_json_path = os.path.join(qodana_project_path, '.qodana', 'open-in-ide.json')
     if os.path.exists(open_in_ide_json_path):
@@ -70,25 +137,21 @@ def get_qodana_metrics(project_path: str, qodana_project_path: str, language: st
 
     results_json_path = os.path.join(qodana_project_path, '.qodana', 'report', 'results', 'result-allProblems.json')
     if os.path.exists(results_json_path):
-        with open(results_json_path) as json_file:
-            data = json.load(json_file)
-            qodana_metrics['problems'] = data["listProblem"]
-            qodana_metrics['problems_count'] = len(data["listProblem"])
-            problems_by_name_count = defaultdict(int)
-            for problem in data["listProblem"]:
-                problems_by_name_count[problem["attributes"]["inspectionName"]] += 1
-            qodana_metrics['problems_by_name_count'] = dict(problems_by_name_count)
+        problems_by_name_count = write_problems_parquet(iter_qodana_problems(results_json_path), problems_path)
+        qodana_metrics['problems_path'] = problems_path
+        qodana_metrics['problems_count'] = sum(problems_by_name_count.values())
+        qodana_metrics['problems_by_name_count'] = problems_by_name_count
     else:
-        qodana_metrics['problems'] = None
+        qodana_metrics['problems_path'] = None
         qodana_metrics['problems_count'] = None
         qodana_metrics['problems_by_name_count'] = None
 
-    if process.returncode == 0:
+    if returncode == 0:
         qodana_metrics['open_status'] = True
         qodana_metrics['error'] = None
     else:
-        print(f"\nAn error occurred: {process.stderr.decode()}")
+        print(f"\nAn error occurred: {error}")
         qodana_metrics['open_status'] = False
-        qodana_metrics['error'] = process.stderr.decode()
+        qodana_metrics['error'] = error
 
     return qodana_metrics
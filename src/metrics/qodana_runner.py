@@ -0,0 +1,134 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import docker
+from docker.errors import ImageNotFound
+from docker.models.containers import Container
+
+STAGING_CONTAINER_PATH = '/data/staging'
+CACHE_CONTAINER_PATH = '/data/cache'
+
+
+def get_qodana_image(language: str) -> str:
+    if language == 'py':
+        return 'jetbrains/qodana-python'
+    return 'jetbrains/qodana-jvm'
+
+
+def stage_project(project_path: str, qodana_project_path: str):
+    """Copies the project into `qodana_project_path`, so the analyzer never modifies the original files.
+
+    Copies share data blocks with the originals where the file system supports reflinks.
+    """
+    if os.path.exists(qodana_project_path):
+        shutil.rmtree(qodana_project_path)
+    os.makedirs(os.path.dirname(qodana_project_path), exist_ok=True)
+    try:
+        subprocess.run(['cp', '-RL', '--reflink=auto', project_path, qodana_project_path],
+                       check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError):
+        # `--reflink` is not supported by BSD cp
+        if os.path.exists(qodana_project_path):
+            shutil.rmtree(qodana_project_path)
+        shutil.copytree(project_path, qodana_project_path)
+
+
+def run_qodana_cold(qodana_project_path: str, language: str) -> tuple[int, str, str]:
+    qodana_command = ['docker', 'run',
+                      '-v', f"{qodana_project_path}:/data/project/",
+                      '-v', f"{os.path.join(qodana_project_path, '.qodana')}:/data/results/",
+                      '-e', f"QODANA_TOKEN={os.environ.get('QODANA_TOKEN')}",
+                      get_qodana_image(language)]
+    process = subprocess.run(qodana_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return process.returncode, process.stdout.decode(), process.stderr.decode()
+
+
+class QodanaRunner:
+    """Runs Qodana analyses in long-lived containers instead of starting a new container for each project.
+
+    Every container mounts the whole staging directory and keeps its own cache directory between runs. Each project
+    is still analysed by a separate analyzer process, so only container creation is saved and the analyzer start-up
+    benefits from the warm cache only. Each container analyses one project at a time.
+    """
+
+    def __init__(self, image: str, staging_path: str, max_containers: int = 1):
+        self.image = image
+        self.staging_path = os.path.abspath(staging_path)
+        self.max_containers = max_containers
+        self.client = docker.from_env()
+        try:
+            image_config = self.client.images.get(image).attrs['Config']
+        except ImageNotFound:
+            image_config = self.client.images.pull(image).attrs['Config']
+        self._entrypoint = list(image_config['Entrypoint'] or []) + list(image_config['Cmd'] or [])
+        self._containers: list[Container] = []
+        self._idle_containers: queue.Queue[Container] = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _start_container(self) -> Container:
+        cache_path = os.path.join(self.staging_path, '.cache', str(len(self._containers)))
+        os.makedirs(cache_path, exist_ok=True)
+        container = self.client.containers.run(
+            image=self.image,
+            entrypoint=['sleep', 'infinity'],
+            volumes={
+                self.staging_path: {'bind': STAGING_CONTAINER_PATH, 'mode': 'rw'},
+                cache_path: {'bind': CACHE_CONTAINER_PATH, 'mode': 'rw'},
+            },
+            detach=True,
+        )
+        self._containers.append(container)
+        return container
+
+    def _acquire_container(self) -> Container:
+        with self._lock:
+            if self._idle_containers.empty() and len(self._containers) < self.max_containers:
+                return self._start_container()
+        return self._idle_containers.get()
+
+    def run(self, qodana_project_path: str) -> tuple[int, str, str]:
+        project_container_path = os.path.join(STAGING_CONTAINER_PATH,
+                                              os.path.relpath(qodana_project_path, self.staging_path))
+        container = self._acquire_container()
+        try:
+            result = container.exec_run(
+                self._entrypoint + ['--project-dir', project_container_path,
+                                    '--results-dir', os.path.join(project_container_path, '.qodana'),
+                                    '--cache-dir', CACHE_CONTAINER_PATH],
+                environment={'QODANA_TOKEN': os.environ.get('QODANA_TOKEN')},
+                demux=True,
+            )
+        finally:
+            self._idle_containers.put(container)
+        stdout, stderr = result.output
+        return result.exit_code, (stdout or b'').decode(), (stderr or b'').decode()
+
+    def shutdown(self):
+        for container in self._containers:
+            container.stop()
+            container.remove()
+        self._containers = []
+        self._idle_containers = queue.Queue()
+
+
+_qodana_runners: dict[tuple[str, str], QodanaRunner] = {}
+_qodana_runners_lock = threading.Lock()
+
+
+def get_qodana_runner(language: str, staging_path: str, max_containers: int = 1) -> QodanaRunner:
+    image = get_qodana_image(language)
+    key = (image, os.path.abspath(staging_path))
+    with _qodana_runners_lock:
+        if key not in _qodana_runners:
+            _qodana_runners[key] = QodanaRunner(image, staging_path, max_containers)
+        return _qodana_runners[key]
+
+
+def shutdown_qodana_runners():
+    with _qodana_runners_lock:
+        for runner in _qodana_runners.values():
+            runner.shutdown()
+        _qodana_runners.clear()
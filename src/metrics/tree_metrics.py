@@ -1,19 +1,20 @@
 import json
-from typing import Any
+from typing import Any, Union
 
 from openai import AsyncOpenAI
 
 from src.eval.agents.utils.openai_utils import chat_completion_request
 from src.metrics.metrics_prompts import get_gen_vanilla_golden_tree_metric_prompt
 from src.metrics.metrics_result import parse_json_response
+from src.utils.project_snapshot import ProjectSnapshot
 from src.utils.project_utils import get_project_file_tree
 
 
-async def compare_tree_metric(gen_project_path: str, vanilla_project_path: str, golden_project_path: str) \
-        -> dict[str, Any]:
-    gen_tree = get_project_file_tree(gen_project_path)
-    vanilla_tree = get_project_file_tree(vanilla_project_path)
-    golden_tree = get_project_file_tree(golden_project_path)
+async def compare_tree_metric(gen_project: Union[str, ProjectSnapshot], vanilla_project: Union[str, ProjectSnapshot],
+                              golden_project: Union[str, ProjectSnapshot]) -> dict[str, Any]:
+    gen_tree = get_project_file_tree(gen_project)
+    vanilla_tree = get_project_file_tree(vanilla_project)
+    golden_tree = get_project_file_tree(golden_project)
 
     chat_response = await chat_completion_request(AsyncOpenAI(), messages=[
         {
@@ -1,3 +1,4 @@
+import json
 import multiprocessing
 import os
 import re
@@ -10,47 +11,19 @@ from dotenv import load_dotenv
 from git import Repo
 from omegaconf import DictConfig
 
-from src.utils.hf_utils import CATEGORIES
+from src.eval.agents.utils.tokenization_utils import TokenizationUtils
+from src.utils.hf_utils import CATEGORIES, TOKENIZATION_PROFILES, TOKENS_COUNT_PREFIXES, get_profile_column_suffix, \
+    get_profile_columns
+from src.utils.project_snapshot import LazyTextContents, ProjectSnapshot
 
 tokenizer = tiktoken.encoding_for_model('gpt-4')
-
-
-def count_repo_symbols(content: dict[str, str]):
-    return sum([count_symbols(content) for content in content.values() if content])
-
-
-def count_repo_tokens(content: dict[str, str]) -> Optional[int]:
-    try:
-        return sum([count_tokens(content) for content in content.values() if content])
-    except Exception as e:
-        print(e)
-    return None
-
-
-def count_repo_words(content: dict[str, str]) -> Optional[int]:
-    try:
-        return sum([count_words(content) for content in content.values() if content])
-    except Exception as e:
-        print(e)
-    return None
-
-
-def count_repo_lines(content: dict[str, str]):
-    return sum(count_lines(content) for content in content.values() if content)
+STATS_CHUNK_SIZE = 256
 
 
 def count_symbols(text: str) -> int:
     return len(text)
 
 
-def count_tokens(text: str) -> Optional[int]:
-    try:
-        return len(tokenizer.encode(text))
-    except Exception as e:
-        print(e)
-    return None
-
-
 def count_lines(text: str) -> int:
     return len(text.split('\n'))
 
@@ -59,28 +32,19 @@ def count_words(text: str) -> int:
     return len(text.split())
 
 
-def get_repo_content(repos_path, owner: str, name: str) -> dict[str, str]:
+def get_repo_content(repos_path, owner: str, name: str) -> LazyTextContents:
     repo_path = os.path.join(repos_path, f'{owner}__{name}')
     if not os.path.exists(repo_path):
         Repo.clone_from(f'https://github.com/{owner}/{name}.git', repo_path)
 
-    repo_content = {}
-    for root, dir, files in os.walk(repo_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            try:
-                with open(file_path, 'r') as f:
-                    repo_content[file_path] = f.read()
-            except Exception as e:
-                print('Can not read file {}'.format(file_path), e)
-    return repo_content
+    return ProjectSnapshot(repo_path).get_text_contents(ignore_hidden=False, ignore_media=False)
 
 
 def get_readme(repo_content):
     readme_content = None
-    for f, c in repo_content.items():
+    for f in repo_content:
         if f.lower().endswith('readme.md'):
-            readme_content = c
+            readme_content = repo_content[f]
             break
     if readme_content is None:
         return ''
@@ -94,36 +58,77 @@ def get_readme(repo_content):
     return readme_content
 
 
+def count_texts_tokens(texts: list[str]) -> list[int]:
+    return [len(tokens) for tokens in tokenizer.encode_batch(texts, disallowed_special=())]
+
+
 def add_stats(config: DictConfig, dp, category: str):
     print(f"Processing {dp['owner']}/{dp['name']}")
     repo_content = get_repo_content(config.repos_path, dp['owner'], dp['name'])
+    readme = get_readme(repo_content)
+    description = dp['description']
 
-    dp['repo_symbols_count'] = count_repo_symbols(repo_content)
-    dp['repo_tokens_count'] = count_repo_tokens(repo_content)
-    dp['repo_words_count'] = count_repo_words(repo_content)
-    dp['repo_lines_count'] = count_repo_lines(repo_content)
+    # Files are read and tokenized by chunks, so only contents of a single chunk are kept in memory
+    files = [f for f in repo_content if repo_content.get_size(f) > 0]
+    code_files = [f for f in files if f.endswith(f'.{category}')]
+    profile_names = ['tokens'] + TOKENIZATION_PROFILES
+
+    def count_tokens(texts: list[str]) -> dict[str, list[int]]:
+        tokens_counts = {'tokens': count_texts_tokens(texts)}
+        for profile_name in TOKENIZATION_PROFILES:
+            tokens_counts[profile_name] = TokenizationUtils.for_profile(profile_name).count_texts_tokens(texts)
+        return tokens_counts
+
+    files_stats = {}
+    for chunk_start in range(0, len(files), STATS_CHUNK_SIZE):
+        chunk_files = files[chunk_start:chunk_start + STATS_CHUNK_SIZE]
+        chunk_contents = [repo_content[f] for f in chunk_files]
+        chunk_tokens_counts = count_tokens(chunk_contents)
+        for i, (f, content) in enumerate(zip(chunk_files, chunk_contents)):
+            files_stats[f] = {
+                'symbols': count_symbols(content),
+                'words': count_words(content),
+                'lines': count_lines(content),
+                **{profile_name: chunk_tokens_counts[profile_name][i] for profile_name in profile_names},
+            }
+    profile_tokens_counts = count_tokens([description, readme])
+
+    def sum_stats(stats_files: list[str], stat: str) -> int:
+        return sum(files_stats[f][stat] for f in stats_files)
+
+    dp['repo_symbols_count'] = sum_stats(files, 'symbols')
+    dp['repo_tokens_count'] = sum_stats(files, 'tokens')
+    dp['repo_words_count'] = sum_stats(files, 'words')
+    dp['repo_lines_count'] = sum_stats(files, 'lines')
     dp['repo_files_count'] = len(repo_content)
 
-    code_repo_content = {f: c for f, c in repo_content.items() if f.endswith(f'.{category}')}
-    dp['repo_code_symbols_count'] = count_repo_symbols(code_repo_content)
-    dp['repo_code_tokens_count'] = count_repo_tokens(code_repo_content)
-    dp['repo_code_words_count'] = count_repo_words(code_repo_content)
-    dp['repo_code_lines_count'] = count_repo_lines(code_repo_content)
-    dp['repo_code_files_count'] = len(code_repo_content)
+    dp['repo_code_symbols_count'] = sum_stats(code_files, 'symbols')
+    dp['repo_code_tokens_count'] = sum_stats(code_files, 'tokens')
+    dp['repo_code_words_count'] = sum_stats(code_files, 'words')
+    dp['repo_code_lines_count'] = sum_stats(code_files, 'lines')
+    dp['repo_code_files_count'] = len([f for f in repo_content if f.endswith(f'.{category}')])
 
-    description = dp['description']
     dp['description_symbols_count'] = count_symbols(description)
-    dp['description_tokens_count'] = count_tokens(description)
+    dp['description_tokens_count'] = profile_tokens_counts['tokens'][-2]
     dp['description_words_count'] = count_words(description)
     dp['description_lines_count'] = count_lines(description)
 
-    readme = get_readme(repo_content)
     dp['readme'] = readme
     dp['readme_symbols_count'] = count_symbols(readme)
-    dp['readme_tokens_count'] = count_tokens(readme)
+    dp['readme_tokens_count'] = profile_tokens_counts['tokens'][-1]
     dp['readme_words_count'] = count_words(readme)
     dp['readme_lines_count'] = count_lines(readme)
 
+    for profile_name in TOKENIZATION_PROFILES:
+        suffix = get_profile_column_suffix(profile_name)
+        tokens_counts = profile_tokens_counts[profile_name]
+        dp[f'repo_tokens_count_{suffix}'] = sum_stats(files, profile_name)
+        dp[f'repo_code_tokens_count_{suffix}'] = sum_stats(code_files, profile_name)
+        dp[f'description_tokens_count_{suffix}'] = tokens_counts[-2]
+        dp[f'readme_tokens_count_{suffix}'] = tokens_counts[-1]
+        dp[f'repo_fits_context_{suffix}'] = \
+            dp[f'repo_tokens_count_{suffix}'] <= TokenizationUtils.for_profile(profile_name).context_size
+
     return dp
 
 
@@ -131,21 +136,101 @@ def add_stats_to_repo_data(config, dps: list[tuple[dict, str]]):
     return [add_stats(config, dp, category) for dp, category in dps]
 
 
+_worker_config: Optional[DictConfig] = None
+_worker_category: Optional[str] = None
+
+
+def init_stats_worker(config: DictConfig, category: str):
+    # Config is sent once per worker instead of with every task, tokenizers are loaded before the first repo
+    global _worker_config, _worker_category
+    _worker_config = config
+    _worker_category = category
+    TokenizationUtils.warm_up(TOKENIZATION_PROFILES)
+
+
+def add_stats_in_worker(dp: dict) -> Optional[dict]:
+    try:
+        return add_stats(_worker_config, dp, _worker_category)
+    except Exception as e:
+        print(f"Failed to process {dp['owner']}/{dp['name']}", e)
+        return None
+
+
+def load_stats(stats_path: str) -> dict[tuple[str, str], dict]:
+    """Loads stats of finished repos, a partially written last line is dropped."""
+    stats = {}
+    if not os.path.exists(stats_path):
+        return stats
+    valid_size = 0
+    with open(stats_path, 'rb') as f:
+        for line in f:
+            try:
+                dp = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if not line.endswith(b'\n'):
+                break
+            valid_size += len(line)
+            stats[(dp['owner'], dp['name'])] = dp
+    if valid_size != os.path.getsize(stats_path):
+        os.truncate(stats_path, valid_size)
+    return stats
+
+
 def calc_stats(config: DictConfig):
     for category in CATEGORIES:
-        df = pd.read_csv(os.path.join(config.data_path, f'{category}_template_repos.csv'))
-
-        params = [(config, dp, category) for _, dp in df.iterrows()]
+        csv_path = os.path.join(config.data_path, f'{category}_template_repos.csv')
+        stats_path = os.path.join(config.data_path, f'{category}_template_repos.stats.jsonl')
+        df = pd.read_csv(csv_path)
+        stats = load_stats(stats_path)
+        dps = [dp for dp in df.to_dict('records') if (dp['owner'], dp['name']) not in stats]
+        print(f"{category}: {len(stats)} repos are already processed, {len(dps)} repos to process")
 
         cpus = multiprocessing.cpu_count()
-        with multiprocessing.Pool(processes=cpus) as pool:
-            results = pool.starmap(add_stats, params)
-        df = pd.DataFrame(results).dropna()
-        df['repo_tokens_count'] = df['repo_tokens_count'].astype('int64')
-        df['repo_code_tokens_count'] = df['repo_code_tokens_count'].astype('int64')
-        df['description_tokens_count'] = df['description_tokens_count'].astype('int64')
-        df['readme_tokens_count'] = df['readme_tokens_count'].astype('int64')
-        df.to_csv(os.path.join(config.data_path, f'{category}_template_repos.csv'), index=False)
+        with multiprocessing.Pool(processes=cpus, initializer=init_stats_worker, initargs=(config, category)) as pool, \
+                open(stats_path, 'a') as stats_file:
+            # Results are persisted as soon as they are ready, so an interrupted run is resumed from them
+            for dp in pool.imap_unordered(add_stats_in_worker, dps, chunksize=config.get('stats_chunksize', 1)):
+                if dp is None:
+                    continue
+                stats_file.write(json.dumps(dp, default=str) + '\n')
+                stats_file.flush()
+                os.fsync(stats_file.fileno())
+                stats[(dp['owner'], dp['name'])] = dp
+
+        failed_keys = {(dp['owner'], dp['name']) for dp in dps if (dp['owner'], dp['name']) not in stats}
+        drop_failed = config.get('stats_drop_failed', False)
+        if len(failed_keys) > 0:
+            failed_repos = [f'{owner}/{name}' for owner, name in failed_keys]
+            if drop_failed:
+                print(f"{category}: {len(failed_repos)} repos failed and are dropped from {csv_path}: {failed_repos}")
+            else:
+                print(f"{category}: {len(failed_repos)} repos failed and are kept in {csv_path} without stats, "
+                      f"rerun to retry them: {failed_repos}")
+
+        keep_failed = len(failed_keys) > 0 and not drop_failed
+        rows = []
+        for dp in df.to_dict('records'):
+            key = (dp['owner'], dp['name'])
+            if key in stats:
+                # Processed repos with missing values are dropped as before
+                if not any(pd.api.types.is_scalar(value) and pd.isna(value) for value in stats[key].values()):
+                    rows.append(stats[key])
+            elif keep_failed:
+                rows.append(dp)
+        df = pd.DataFrame(rows)
+
+        dtypes = {f'{prefix}_tokens_count': 'int64' for prefix in TOKENS_COUNT_PREFIXES}
+        for profile_name in TOKENIZATION_PROFILES:
+            dtypes.update(get_profile_columns(profile_name))
+        if keep_failed:
+            # Stats of failed repos are missing, so nullable types are used
+            dtypes = {column: {'int64': 'Int64', 'bool': 'boolean'}[dtype] for column, dtype in dtypes.items()}
+            df = df.reindex(columns=list(dict.fromkeys([*df.columns, *dtypes])))
+        df = df.astype(dtypes)
+        df.to_csv(csv_path, index=False)
+        if not keep_failed:
+            os.remove(stats_path)
 
 
 @hydra.main(config_path="../../configs/template_generation", config_name="data", version_base=None)
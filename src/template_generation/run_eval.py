@@ -1,33 +1,40 @@
 import asyncio
-import csv
 import json
 import os
 import shutil
 import time
+from typing import Optional
 
 import hydra
-import pandas as pd
 import yaml
 from dotenv import load_dotenv
 from hydra.core.hydra_config import HydraConfig
 from langchain_core.tracers.context import tracing_v2_enabled
 from langsmith import Client
-from tenacity import retry, stop_after_attempt
+from tenacity import retry, stop_after_attempt, RetryError
 
 from src.configs.eval_configs import EvalConfig
 from src.eval.agents.base_agent import BaseAgent
+from src.eval.agents.utils.journal_utils import trajectory_journal
+from src.eval.agents.utils.rate_limit_utils import set_rate_limit_tenant
+from src.eval.agents.utils.tokenization_utils import TokenizationUtils
 from src.eval.data_sources.base_data_source import BaseDataSource
 from src.eval.envs.base_env import BaseEnv
+from src.eval.envs.recording_env import RecordingEnv
 from src.template_generation.prompts import get_user_prompt
+from src.utils.results_store import ResultsStore
 
 
 @retry(stop=stop_after_attempt(3))
 async def run_template_generation_for_project(project, agent: BaseAgent, env: BaseEnv,
-                                              template_generation_path: str, job_name: str) -> dict[str, any]:
+                                              template_generation_path: str, job_name: str,
+                                              trajectory_path: Optional[str] = None) -> dict[str, any]:
+    project_name = f'{project["owner"]}__{project["name"]}'
+    project_template_path = os.path.join(template_generation_path, project_name)
+    # Journal is kept next to the template directory, so it survives the template directory cleanup on retry
+    journal_path = os.path.join(template_generation_path, f'{project_name}.journal.jsonl')
     try:
-        # Init template directory
-        project_name = f'{project["owner"]}__{project["name"]}'
-        project_template_path = os.path.join(template_generation_path, project_name)
+        # Init template directory, files generated by a failed attempt are restored by replaying the journal
         if os.path.exists(project_template_path):
             shutil.rmtree(project_template_path)
         os.makedirs(project_template_path)
@@ -50,7 +57,8 @@ async def run_template_generation_for_project(project, agent: BaseAgent, env: Ba
 
         start_time = time.time()
 
-        with tracing_v2_enabled(project_name=langsmith_project_name):
+        with trajectory_journal(journal_path) as journal, tracing_v2_enabled(project_name=langsmith_project_name):
+            journal.record_input(user_prompt)
             messages = await agent.run(env, user_prompt)
 
         end_time = time.time()
@@ -72,48 +80,119 @@ async def run_template_generation_for_project(project, agent: BaseAgent, env: Ba
 
     except Exception as e:
         print(e)
-        return None
+        raise
     finally:
         await env.shutdown()
 
+    if trajectory_path is not None:
+        # Keep the recorded trajectory for replaying it later
+        os.makedirs(os.path.dirname(trajectory_path), exist_ok=True)
+        os.replace(journal_path, trajectory_path)
+    else:
+        os.remove(journal_path)
+
     return result_dict
 
 
 @retry(stop=stop_after_attempt(3))
-async def run_template_generation(agent: BaseAgent, env: BaseEnv, data_source: BaseDataSource,
-                                  output_path: str, job_name: str):
-    for project, config in data_source:
-        config_path = os.path.join(output_path, config)
-        os.makedirs(config_path, exist_ok=True)
-        result_path = os.path.join(config_path, "results.csv")
-        if os.path.exists(result_path) and os.path.getsize(result_path) > 0:
-            df = pd.read_csv(result_path)
-            if project['full_name'] in list(df['full_name']):
+async def run_template_generation(workers: list[tuple[BaseAgent, BaseEnv]], data_source: BaseDataSource,
+                                  output_path: str, job_name: str, trajectories_path: Optional[str] = None):
+    # Each worker owns its agent and env, so at most len(workers) projects are processed at the same time
+    free_workers = asyncio.Queue()
+    for worker in workers:
+        free_workers.put_nowait(worker)
+
+    results_store = ResultsStore(os.path.join(output_path, "results.db"))
+
+    async def process_project(project, config: str, agent: BaseAgent, env: BaseEnv, gen_templates_path: str):
+        # LLM requests of concurrently processed projects are served in turn
+        set_rate_limit_tenant(project['full_name'])
+        trajectory_path = None
+        if trajectories_path is not None:
+            trajectory_path = os.path.join(trajectories_path, config, f'{project["owner"]}__{project["name"]}.jsonl')
+        try:
+            results_dict = await run_template_generation_for_project(
+                project, agent, env, gen_templates_path, job_name, trajectory_path)
+        except RetryError as e:
+            print(e)
+            results_dict = None
+        finally:
+            free_workers.put_nowait((agent, env))
+
+        if results_dict is None:
+            print(f"Failed to generate template for {project['full_name']}")
+            return
+        results_store.append(config, results_dict)
+
+    configs = set()
+    tasks = []
+    try:
+        for project, config in data_source:
+            config_path = os.path.join(output_path, config)
+            if config not in configs:
+                configs.add(config)
+                os.makedirs(config_path, exist_ok=True)
+                if not results_store.has_config(config):
+                    results_store.import_csv(config, os.path.join(config_path, "results.csv"))
+            if (config, project['full_name']) in results_store:
                 print(f"Skipping {project['full_name']}")
                 continue
-        gen_templates_path = os.path.join(config_path, "gen_templates")
-        os.makedirs(gen_templates_path, exist_ok=True)
+            gen_templates_path = os.path.join(config_path, "gen_templates")
+            os.makedirs(gen_templates_path, exist_ok=True)
 
-        results_dict = await run_template_generation_for_project(
-            project, agent, env, gen_templates_path, job_name)
+            agent, env = await free_workers.get()
+            tasks.append(asyncio.create_task(
+                process_project(project, config, agent, env, gen_templates_path)))
 
-        with open(result_path, 'a', newline='') as f:
-            writer = csv.writer(f)
-            if f.tell() == 0:
-                writer.writerow(results_dict.keys())
-            writer.writerow(results_dict.values())
+        await asyncio.gather(*tasks)
+    finally:
+        # Tasks left after a failure still drive the workers' envs, so they are stopped before a retry reuses them
+        for task in tasks:
+            task.cancel()
+        try:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            # Keep results.csv as the format consumed by notebooks and metrics
+            for config in configs:
+                results_store.export_csv(config, os.path.join(output_path, config, "results.csv"))
+            # Tasks still append results if waiting for them was interrupted, so the store is closed only after them
+            if all(task.done() for task in tasks):
+                results_store.close()
+
+
+def warm_up_tokenizers(cfg: EvalConfig):
+    profile_names = [cfg.agent.get('model_name'), cfg.agent.get('prompt', {}).get('model_name')]
+    TokenizationUtils.warm_up(profile_names)
+
+
+def create_workers(cfg: EvalConfig) -> list[tuple[BaseAgent, BaseEnv]]:
+    workers = []
+    for i in range(cfg.max_concurrent_projects):
+        # Every additional env listens on its own port and runs in its own container
+        env_overrides = {}
+        if i > 0 and 'port' in cfg.env:
+            env_overrides['port'] = int(cfg.env.port) + i
+        if i > 0 and 'docker_container_name' in cfg.env:
+            env_overrides['docker_container_name'] = f'{cfg.env.docker_container_name}-{i}'
+
+        agent: BaseAgent = hydra.utils.instantiate(cfg.agent)
+        env: BaseEnv = RecordingEnv(hydra.utils.instantiate(cfg.env, **env_overrides))
+        workers.append((agent, env))
+
+    return workers
 
 
 @hydra.main(config_path="../../configs/template_generation", config_name="config.yaml", version_base="1.2")
 def main(cfg: EvalConfig) -> None:
-    agent: BaseAgent = hydra.utils.instantiate(cfg.agent)
-    env: BaseEnv = hydra.utils.instantiate(cfg.env)
+    warm_up_tokenizers(cfg)
+    workers = create_workers(cfg)
     data_source: BaseDataSource = hydra.utils.instantiate(cfg.data_source)
 
     output_path = HydraConfig.get().run.dir
     job_name = HydraConfig.get().job.name
 
-    asyncio.run(run_template_generation(agent, env, data_source, output_path, job_name))
+    asyncio.run(run_template_generation(workers, data_source, output_path, job_name, cfg.trajectories_path))
+    print(f"Tokenizers registry stats: {TokenizationUtils.get_registry_stats()}")
 
 
 def delete_langsmith_projects():
@@ -69,7 +69,8 @@ def load_repos_data(config: DictConfig):
         with open(config.github_tokens_path, "r") as f:
             github_tokens = [token.strip() for token in f.readlines()]
 
-        data_provider = GithubDataProvider(github_tokens=github_tokens)
+        data_provider = GithubDataProvider(github_tokens=github_tokens,
+                                           http_cache_path=config.get('github_http_cache_path'))
         data_provider.load_repos_meta(repos, os.path.join(config.data_path, f"{category}_repos_meta_extra.jsonl"))
 
 
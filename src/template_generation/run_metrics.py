@@ -1,27 +1,60 @@
+import ast
 import asyncio
 import csv
+import hashlib
+import multiprocessing
 import os
+import sys
+import time
 from collections import defaultdict
-from typing import Any
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
 
 import hydra
 import pandas as pd
-from datasets import Dataset
 from dotenv import load_dotenv
 from langsmith import Client
 from omegaconf import DictConfig
 
+from src.metrics.base_metrics import init_metric_engine
 from src.metrics.project_gen_metrics import gen_golden_content_metrics, gen_golden_content_metric_by_files, \
-    get_closest_project_index
-from src.metrics.qodana_metrics import get_qodana_metrics
+    gen_golden_content_metrics_batch
+from src.metrics.project_index import ProjectDescriptionIndex
+from src.metrics.qodana_metrics import get_qodana_metrics, write_problems_parquet
+from src.metrics.qodana_runner import get_qodana_runner, shutdown_qodana_runners
 from src.metrics.tree_metrics import compare_tree_metric
 from src.metrics.file_metrics import get_files_metrics
 from src.template_generation.code_engine_env.code_engine_env_tools import code_engine_tools_to_handler
 from src.utils.git_utils import clone_repo
 from src.utils.hf_utils import load_data
+from src.utils.metrics_memo import MetricsMemo
+from src.utils.project_snapshot import ProjectSnapshot
+
+METRICS_STAGES_FILES = {
+    'quality': 'quality_metrics.csv',
+    'cost': 'cost_metrics.csv',
+    'qodana': 'qodana_metrics.csv',
+    'compare': 'quality_closest_metrics.csv',
+}
+# Bump a version to recompute the stage for all projects, cost metrics are not memoized as they have no file inputs
+METRICS_STAGES_VERSIONS = {
+    'quality': 1,
+    'qodana': 1,
+    'compare': 1,
+}
+# Qodana columns which kept the whole logs and problems inline before they were moved into sidecar files
+QODANA_LEGACY_COLUMNS = ['logs', 'problems']
 
 
 def write_to_csv(metrics_path, keys: list[str], values: list[Any]):
+    if os.path.exists(metrics_path) and os.path.getsize(metrics_path) > 0:
+        with open(metrics_path, newline='') as f:
+            header = next(csv.reader(f))
+        if header != keys:
+            # Columns changed since the file was written, so previous rows are rewritten with the new columns
+            df = pd.concat([pd.read_csv(metrics_path), pd.DataFrame([values], columns=keys)], ignore_index=True)
+            df.to_csv(metrics_path, index=False)
+            return
     with open(metrics_path, 'a', newline='') as f:
         writer = csv.writer(f)
         if f.tell() == 0:
@@ -29,46 +62,64 @@ def write_to_csv(metrics_path, keys: list[str], values: list[Any]):
         writer.writerow(values)
 
 
-def get_quality_metrics(gen_template_result, repos_path: str, output_path: str):
-    golden_project_path = os.path.join(repos_path, f"{gen_template_result['owner']}__{gen_template_result['name']}")
+def write_row_to_csv(metrics_path, row: dict[str, Any]):
+    write_to_csv(metrics_path, list(row.keys()), list(row.values()))
 
-    quality_metrics = {}
-    metrics_path = os.path.join(output_path, f'quality_metrics.csv')
-    if os.path.exists(metrics_path) and gen_template_result['id'] in list(pd.read_csv(metrics_path)['id']):
-        print(f"Skipping project: {gen_template_result['full_name']}")
-        return
 
-    print(f"Processing project: {gen_template_result['full_name']}")
-    gen_project_path = gen_template_result['project_template_path']
+def get_processed_ids(metrics_path: str) -> set:
+    if not os.path.exists(metrics_path):
+        return set()
+    return set(pd.read_csv(metrics_path, usecols=['id'])['id'])
 
-    content_metrics = gen_golden_content_metrics(gen_project_path, golden_project_path)
-    quality_metrics.update(content_metrics)
 
-    content_metric_by_files = gen_golden_content_metric_by_files(gen_project_path, golden_project_path)
-    quality_metrics.update(content_metric_by_files)
+def remove_rows_from_csv(metrics_path: str, ids: set):
+    df = pd.read_csv(metrics_path)
+    df[~df['id'].isin(ids)].to_csv(metrics_path, index=False)
 
-    files_metrics = get_files_metrics(gen_project_path, golden_project_path)
-    quality_metrics.update(files_metrics)
 
-    write_to_csv(metrics_path, ['id', 'full_name', 'owner', 'name'] + list(quality_metrics.keys()),
-                 [gen_template_result['id'],
-                  gen_template_result['full_name'],
-                  gen_template_result['owner'],
-                  gen_template_result['name']] + list(quality_metrics.values()))
+def get_project_row(gen_template_result) -> dict[str, Any]:
+    return {
+        'id': gen_template_result['id'],
+        'full_name': gen_template_result['full_name'],
+        'owner': gen_template_result['owner'],
+        'name': gen_template_result['name'],
+    }
 
 
-def get_cost_metrics(gen_template_result, agent_name: str, output_path: str):
-    metrics_path = os.path.join(output_path, f'cost_metrics.csv')
-    if os.path.exists(metrics_path) and gen_template_result['id'] in list(pd.read_csv(metrics_path)['id']):
-        print(f"Skipping project: {gen_template_result['full_name']}")
-        return
+def get_quality_metrics(gen_template_results: list[dict[str, Any]], repos_path: str, batch_size: int = 32) \
+        -> list[dict[str, Any]]:
+    # Each project is scanned once and its snapshot is shared by all quality metrics
+    projects = [(ProjectSnapshot(gen_template_result['project_template_path']),
+                 ProjectSnapshot(os.path.join(repos_path,
+                                              f"{gen_template_result['owner']}__{gen_template_result['name']}")))
+                for gen_template_result in gen_template_results]
+    batch_content_metrics = gen_golden_content_metrics_batch(projects, batch_size)
+
+    rows = []
+    for gen_template_result, (gen_project, golden_project), content_metrics \
+            in zip(gen_template_results, projects, batch_content_metrics):
+        print(f"Processing project: {gen_template_result['full_name']}")
+        quality_metrics = get_project_row(gen_template_result)
+        quality_metrics.update(content_metrics)
 
+        content_metric_by_files = gen_golden_content_metric_by_files(gen_project, golden_project)
+        quality_metrics.update(content_metric_by_files)
+
+        files_metrics = get_files_metrics(gen_project, golden_project)
+        quality_metrics.update(files_metrics)
+        rows.append(quality_metrics)
+
+    return rows
+
+
+def get_cost_metrics(gen_template_result, agent_name: str) -> Optional[dict[str, Any]]:
     langsmith_project_name = f"{gen_template_result['full_name']}-{agent_name}"
     client = Client()
     if not client.has_project(langsmith_project_name):
-        return
+        return None
 
-    cost_metrics = {}
+    cost_metrics = get_project_row(gen_template_result)
+    cost_metrics['time'] = gen_template_result['time']
     langsmith_project = client.read_project(project_name=langsmith_project_name)
     cost_metrics['total_tokens'] = langsmith_project.total_tokens
     cost_metrics['prompt_tokens'] = langsmith_project.prompt_tokens
@@ -76,13 +127,7 @@ def get_cost_metrics(gen_template_result, agent_name: str, output_path: str):
 
     runs_stats = get_langsmith_metrics(langsmith_project_name)
     cost_metrics.update(runs_stats)
-
-    write_to_csv(metrics_path, ['id', 'full_name', 'owner', 'name', 'time'] + list(cost_metrics.keys()),
-                 [gen_template_result['id'],
-                  gen_template_result['full_name'],
-                  gen_template_result['owner'],
-                  gen_template_result['name'],
-                  gen_template_result['time']] + list(cost_metrics.values()))
+    return cost_metrics
 
 
 def get_langsmith_metrics(langsmith_project_name: str) -> dict:
@@ -117,84 +162,340 @@ def get_langsmith_metrics(langsmith_project_name: str) -> dict:
     return runs_stats
 
 
-async def get_quality_compare_metrics(gen_template_result, projects: Dataset, repos_path: str, output_path: str):
+async def get_quality_compare_metrics(gen_template_result, description_index: ProjectDescriptionIndex,
+                                      repos_path: str) -> Optional[dict[str, Any]]:
     golden_project_path = os.path.join(repos_path, f"{gen_template_result['owner']}__{gen_template_result['name']}")
     gen_project_path = gen_template_result['project_template_path']
 
-    metrics_path = os.path.join(output_path, f'quality_closest_metrics.csv')
-    if os.path.exists(metrics_path) and gen_template_result['id'] in list(pd.read_csv(metrics_path)['id']):
-        print(f"Skipping project: {gen_template_result['full_name']}")
-        return
-
     prove_quality_metrics = {}
 
-    other_projects = projects.filter(lambda p: p['id'] != gen_template_result['id'])
-    closest_project_id = get_closest_project_index(
-        projects.filter(lambda p: p['id'] == gen_template_result['id'])['gpt_description'][0],
-        list(other_projects['gpt_description'])
-    )
-    closest_project = other_projects[closest_project_id]
+    closest_rows = await asyncio.to_thread(description_index.get_closest_rows, gen_template_result['id'])
+    if len(closest_rows) == 0:
+        print(f"No other projects to compare {gen_template_result['full_name']} with, skipping compare metrics")
+        return None
+    closest_row = closest_rows[0]
+    closest_project = description_index.projects[closest_row]
     closest_project_path = os.path.join(repos_path, f"{closest_project['owner']}__{closest_project['name']}")
 
     await clone_repo(closest_project["owner"], closest_project["name"], closest_project_path)
-    content_metric = gen_golden_content_metrics(closest_project_path, golden_project_path)
+    closest_project_snapshot = await asyncio.to_thread(ProjectSnapshot, closest_project_path)
+    golden_project_snapshot = await asyncio.to_thread(ProjectSnapshot, golden_project_path)
+    content_metric = await asyncio.to_thread(gen_golden_content_metrics, closest_project_snapshot,
+                                             golden_project_snapshot)
     prove_quality_metrics.update(content_metric)
 
-    content_metric_by_files = gen_golden_content_metric_by_files(closest_project_path, golden_project_path)
+    content_metric_by_files = await asyncio.to_thread(gen_golden_content_metric_by_files,
+                                                      closest_project_snapshot, golden_project_snapshot)
     prove_quality_metrics.update(content_metric_by_files)
 
     tree_metrics = await compare_tree_metric(gen_project_path,
-                                             closest_project_path,
-                                             golden_project_path)
+                                             closest_project_snapshot,
+                                             golden_project_snapshot)
     prove_quality_metrics['tree_result'] = tree_metrics.get("result", "-1")
     prove_quality_metrics['tree_comment'] = tree_metrics.get("comment", "")
 
-    write_to_csv(metrics_path,
-                 ['id', 'full_name', 'owner', 'name'] +
-                 ['closest_id', 'closest_full_name', 'closest_owner', 'closest_name'] +
-                 list(prove_quality_metrics.keys()),
-                 [gen_template_result['id'], gen_template_result['full_name'], gen_template_result['owner'],
-                  gen_template_result['name']] +
-                 [closest_project['id'], closest_project['full_name'], closest_project['owner'],
-                  closest_project['name']]
-                 + list(prove_quality_metrics.values()))
-
-
-def get_qodana_run_metrics(gen_template_result, language, output_path: str):
-    metrics_path = os.path.join(output_path, f'qodana_metrics.csv')
-    if os.path.exists(metrics_path) and gen_template_result['id'] in list(pd.read_csv(metrics_path)['id']):
-        print(f"Skipping project: {gen_template_result['full_name']}")
+    return {
+        **get_project_row(gen_template_result),
+        'closest_id': closest_project['id'],
+        'closest_full_name': closest_project['full_name'],
+        'closest_owner': closest_project['owner'],
+        'closest_name': closest_project['name'],
+        **prove_quality_metrics,
+    }
+
+
+def get_qodana_problems_path(output_path: str, project_id) -> str:
+    return os.path.join(output_path, 'qodana_problems', f"{project_id}.parquet")
+
+
+def get_qodana_logs_path(output_path: str, project_id) -> str:
+    return os.path.join(output_path, 'qodana_logs', f"{project_id}.log")
+
+
+def migrate_qodana_csv(output_path: str):
+    """Moves inline logs and problems of qodana rows written before sidecar files were introduced into sidecars."""
+    metrics_path = os.path.join(output_path, METRICS_STAGES_FILES['qodana'])
+    if not os.path.exists(metrics_path) or os.path.getsize(metrics_path) == 0:
+        return
+    # Inline logs and problems exceed the default csv field size limit
+    csv.field_size_limit(sys.maxsize)
+    with open(metrics_path, newline='') as f:
+        header = next(csv.reader(f))
+    if not any(column in header for column in QODANA_LEGACY_COLUMNS):
         return
 
+    print(f"Moving inline qodana logs and problems of {metrics_path} into sidecar files...")
+    df = pd.read_csv(metrics_path)
+    for column in ['logs_path', 'problems_path']:
+        if column not in df.columns:
+            df[column] = None
+        df[column] = df[column].astype(object)
+    for i, row in df.iterrows():
+        if 'logs' in df.columns and pd.notna(row['logs']) and pd.isna(row['logs_path']):
+            logs_path = get_qodana_logs_path(output_path, row['id'])
+            os.makedirs(os.path.dirname(logs_path), exist_ok=True)
+            with open(logs_path, 'w') as f:
+                f.write(row['logs'])
+            df.at[i, 'logs_path'] = logs_path
+        if 'problems' in df.columns and pd.notna(row['problems']) and pd.isna(row['problems_path']):
+            problems_path = get_qodana_problems_path(output_path, row['id'])
+            try:
+                # Problems were written as the repr of the parsed report list
+                write_problems_parquet(iter(ast.literal_eval(row['problems'])), problems_path)
+            except (ValueError, SyntaxError, KeyError, TypeError) as e:
+                print(f"Can not parse inline qodana problems of {row['id']}, keeping them as text", e)
+                problems_path = f'{os.path.splitext(problems_path)[0]}.txt'
+                os.makedirs(os.path.dirname(problems_path), exist_ok=True)
+                with open(problems_path, 'w') as f:
+                    f.write(row['problems'])
+            df.at[i, 'problems_path'] = problems_path
+
+    tmp_metrics_path = f'{metrics_path}.tmp'
+    df.drop(columns=[column for column in QODANA_LEGACY_COLUMNS if column in df.columns]) \
+        .to_csv(tmp_metrics_path, index=False)
+    os.replace(tmp_metrics_path, metrics_path)
+
+
+def get_qodana_run_metrics(gen_template_result, language, output_path: str, warm: bool = True,
+                           max_containers: int = 1) -> dict[str, Any]:
     gen_project_path = gen_template_result['project_template_path']
     project_name = gen_project_path.split('/')[-1]
-    qodana_project_path = os.path.join(output_path, 'qodana_metrics', project_name)
-    qodana_metrics = get_qodana_metrics(gen_project_path, qodana_project_path, language)
-    write_to_csv(metrics_path,
-                 ['id', 'full_name', 'owner', 'name'] + list(qodana_metrics.keys()),
-                 [gen_template_result['id'], gen_template_result['full_name'], gen_template_result['owner'],
-                  gen_template_result['name']] + list(qodana_metrics.values()))
+    staging_path = os.path.join(output_path, 'qodana_metrics')
+    qodana_project_path = os.path.join(staging_path, project_name)
+    problems_path = get_qodana_problems_path(output_path, gen_template_result['id'])
+    logs_path = get_qodana_logs_path(output_path, gen_template_result['id'])
+    runner = get_qodana_runner(language, staging_path, max_containers) if warm else None
+    qodana_metrics = get_qodana_metrics(gen_project_path, qodana_project_path, language, problems_path, logs_path,
+                                        runner)
     print(qodana_metrics)
+    return {**get_project_row(gen_template_result), **qodana_metrics}
+
+
+class StageProgress:
+
+    def __init__(self, stage: str, total: int, skipped: int):
+        self.stage = stage
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self._started_at = time.monotonic()
+        print(f"[{stage}] {total} projects to process, {skipped} already processed")
+
+    def update(self, count: int = 1, failed: bool = False):
+        self.done += count
+        if failed:
+            self.failed += count
+        rate = self.done / max(time.monotonic() - self._started_at, 1e-9)
+        print(f"[{self.stage}] {self.done}/{self.total} projects processed, {self.failed} failed, "
+              f"{rate:.2f} projects/s")
+
+
+class MetricsPipeline:
+    """Runs metric stages concurrently, each one in an executor suited to its bottleneck.
+
+    Quality metrics are computed by batches in a process pool, cost and closest project metrics are network-bound
+    and run as tasks with bounded concurrency, Qodana runs are limited by the number of simultaneous containers.
+    Results are written to csv files only from the main process. Projects are skipped while their results are
+    fresh, i.e. the stage version and Merkle hashes of the generated and golden projects are unchanged.
+    """
+
+    def __init__(self, config: DictConfig):
+        self.config = config
+        self.stages = list(config.get('stages', ['qodana']))
+        for stage in self.stages:
+            if stage not in METRICS_STAGES_FILES:
+                raise ValueError(f"Metrics stage {stage} is not supported")
+        self._description_indices: dict[str, ProjectDescriptionIndex] = {}
+        self._memo: Optional[MetricsMemo] = None
+        self._hashes: dict[tuple[str, str], tuple[str, str]] = {}
+
+    def _get_runs(self) -> list[tuple[str, str, list[dict[str, Any]], str]]:
+        runs = []
+        for entry in os.scandir(self.config.gen_templates_path):
+            if not entry.is_dir():
+                continue
+            agent_name = os.path.basename(entry.path)
+            for language in ['py', 'java', 'kt']:
+                output_path = str(os.path.join(entry, language))
+                if not os.path.exists(output_path):
+                    continue
+                df = pd.read_csv(os.path.join(output_path, 'results.csv'))
+                metrics_path = os.path.join(self.config.metrics_path, agent_name, language)
+                os.makedirs(metrics_path, exist_ok=True)
+                runs.append((agent_name, language, df.to_dict('records'), metrics_path))
+        return runs
+
+    def _get_description_index(self, language: str) -> ProjectDescriptionIndex:
+        if language not in self._description_indices:
+            self._description_indices[language] = ProjectDescriptionIndex(
+                load_data(language, 'dev'),
+                os.path.join(self.config.metrics_path, 'description_index', f'{language}_dev.npz'))
+        return self._description_indices[language]
+
+    def _get_memo_key(self, gen_template_result, metrics_path: str) -> str:
+        return f"{os.path.relpath(metrics_path, self.config.metrics_path)}/{gen_template_result['id']}"
+
+    def _get_neighbour_hash(self, gen_template_result, language: str) -> str:
+        """Returns the hash of the closest project compare metrics are calculated against, empty if there is none."""
+        description_index = self._get_description_index(language)
+        closest_rows = description_index.get_closest_rows(gen_template_result['id'])
+        if len(closest_rows) == 0:
+            return ''
+        closest_project = description_index.projects[closest_rows[0]]
+        closest_project_path = os.path.join(self.config.repos_path,
+                                            f"{closest_project['owner']}__{closest_project['name']}")
+        return f"{closest_project['id']}:{self._memo.hash_directory(closest_project_path)}"
+
+    def _get_hashes(self, stage: str, gen_template_result, language: str) -> tuple[str, str]:
+        gen_hash = self._memo.hash_directory(gen_template_result['project_template_path'])
+        if stage == 'qodana':
+            return gen_hash, ''
+        golden_project_path = os.path.join(self.config.repos_path,
+                                           f"{gen_template_result['owner']}__{gen_template_result['name']}")
+        golden_hash = self._memo.hash_directory(golden_project_path)
+        if stage == 'compare':
+            # A re-picked or changed closest project invalidates compare metrics as well as the golden one
+            neighbour_hash = self._get_neighbour_hash(gen_template_result, language)
+            golden_hash = hashlib.sha256(f'{golden_hash}\n{neighbour_hash}'.encode()).hexdigest()
+        return gen_hash, golden_hash
+
+    def _get_pending(self, stage: str, runs) -> tuple[list[tuple[str, str, list[dict[str, Any]], str]], int]:
+        """Selects projects without results, and projects which changed since their results were calculated."""
+        pending_runs = []
+        skipped = 0
+        version = METRICS_STAGES_VERSIONS.get(stage)
+        for agent_name, language, gen_template_results, metrics_path in runs:
+            stage_metrics_path = os.path.join(metrics_path, METRICS_STAGES_FILES[stage])
+            processed_ids = get_processed_ids(stage_metrics_path)
+            pending = []
+            changed_ids = set()
+            for gen_template_result in gen_template_results:
+                if version is None:
+                    if gen_template_result['id'] not in processed_ids:
+                        pending.append(gen_template_result)
+                    continue
+
+                memo_key = self._get_memo_key(gen_template_result, metrics_path)
+                hashes = self._get_hashes(stage, gen_template_result, language)
+                self._hashes[(stage, memo_key)] = hashes
+                if gen_template_result['id'] not in processed_ids:
+                    pending.append(gen_template_result)
+                    continue
+                memo_entry = self._memo.get(stage, memo_key)
+                if memo_entry is None:
+                    # Results calculated before memoization are adopted as they are
+                    self._memo.update(stage, memo_key, version, *hashes)
+                elif tuple(memo_entry) != (version, *hashes):
+                    changed_ids.add(gen_template_result['id'])
+                    pending.append(gen_template_result)
+
+            if len(changed_ids) > 0:
+                print(f"[{stage}] Recalculating {len(changed_ids)} changed projects in {stage_metrics_path}")
+                remove_rows_from_csv(stage_metrics_path, changed_ids)
+            skipped += len(gen_template_results) - len(pending)
+            pending_runs.append((agent_name, language, pending, metrics_path))
+        return pending_runs, skipped
+
+    def _write_row(self, stage: str, row: dict[str, Any], metrics_path: str):
+        write_row_to_csv(os.path.join(metrics_path, METRICS_STAGES_FILES[stage]), row)
+        version = METRICS_STAGES_VERSIONS.get(stage)
+        if version is not None:
+            memo_key = self._get_memo_key(row, metrics_path)
+            self._memo.update(stage, memo_key, version, *self._hashes[(stage, memo_key)])
+
+    async def _run_quality_stage(self, runs):
+        pending_runs, skipped = await asyncio.to_thread(self._get_pending, 'quality', runs)
+        progress = StageProgress('quality', sum(len(pending) for _, _, pending, _ in pending_runs), skipped)
+        batch_size = self.config.get('quality_batch_size', 32)
+        loop = asyncio.get_running_loop()
+
+        # Forking while other stages hold torch and tokenizer threads may deadlock the workers
+        with ProcessPoolExecutor(max_workers=self.config.get('quality_workers', 1),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_metric_engine,
+                                 initargs=(self.config.get('embeddings_path'),)) as executor:
+            async def process_batch(batch: list[dict[str, Any]], metrics_path: str):
+                try:
+                    rows = await loop.run_in_executor(executor, get_quality_metrics, batch, self.config.repos_path,
+                                                      batch_size)
+                except Exception as e:
+                    print(f"Failed to calculate quality metrics: {e}")
+                    progress.update(len(batch), failed=True)
+                    return
+                for row in rows:
+                    self._write_row('quality', row, metrics_path)
+                progress.update(len(batch))
+
+            await asyncio.gather(*[process_batch(pending[i:i + batch_size], metrics_path)
+                                   for _, _, pending, metrics_path in pending_runs
+                                   for i in range(0, len(pending), batch_size)])
+
+    async def _run_project_stage(self, stage: str, runs, concurrency: int):
+        if stage == 'qodana':
+            for _, _, _, metrics_path in runs:
+                await asyncio.to_thread(migrate_qodana_csv, metrics_path)
+        if stage == 'compare':
+            # Dataset loading and description embedding are blocking, so they are kept off the event loop
+            for language in {language for _, language, _, _ in runs}:
+                description_index = await asyncio.to_thread(self._get_description_index, language)
+                await asyncio.to_thread(description_index.load)
+        pending_runs, skipped = await asyncio.to_thread(self._get_pending, stage, runs)
+        progress = StageProgress(stage, sum(len(pending) for _, _, pending, _ in pending_runs), skipped)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def process_project(gen_template_result: dict[str, Any], agent_name: str, language: str,
+                                  metrics_path: str):
+            async with semaphore:
+                try:
+                    if stage == 'cost':
+                        row = await asyncio.to_thread(get_cost_metrics, gen_template_result, agent_name)
+                    elif stage == 'qodana':
+                        row = await asyncio.to_thread(get_qodana_run_metrics, gen_template_result, language,
+                                                      metrics_path, self.config.get('qodana_warm', True),
+                                                      concurrency)
+                    else:
+                        row = await get_quality_compare_metrics(gen_template_result,
+                                                                self._get_description_index(language),
+                                                                self.config.repos_path)
+                        if row is not None and METRICS_STAGES_VERSIONS.get(stage) is not None:
+                            # The closest project is cloned only now, so its hash is taken after the calculation
+                            memo_key = self._get_memo_key(gen_template_result, metrics_path)
+                            self._hashes[(stage, memo_key)] = await asyncio.to_thread(
+                                self._get_hashes, stage, gen_template_result, language)
+                except Exception as e:
+                    print(f"Failed to calculate {stage} metrics for {gen_template_result['full_name']}: {e}")
+                    progress.update(failed=True)
+                    return
+            if row is not None:
+                self._write_row(stage, row, metrics_path)
+            progress.update()
+
+        try:
+            await asyncio.gather(*[process_project(gen_template_result, agent_name, language, metrics_path)
+                                   for agent_name, language, pending, metrics_path in pending_runs
+                                   for gen_template_result in pending])
+        finally:
+            if stage == 'qodana':
+                shutdown_qodana_runners()
+
+    async def run(self):
+        runs = self._get_runs()
+        self._memo = MetricsMemo(os.path.join(self.config.metrics_path, 'metrics_memo.db'))
+        stage_runs = []
+        for stage in self.stages:
+            if stage == 'quality':
+                stage_runs.append(self._run_quality_stage(runs))
+            else:
+                stage_runs.append(self._run_project_stage(stage, runs, self.config.get(f'{stage}_concurrency', 1)))
+        try:
+            await asyncio.gather(*stage_runs)
+        finally:
+            self._memo.close()
 
 
 async def eval_metrics(config: DictConfig):
-    for entry in os.scandir(config.gen_templates_path):
-        if not entry.is_dir():
-            continue
-        agent_name = os.path.basename(entry.path)
-        for language in ['py', 'java', 'kt']:
-            output_path = str(os.path.join(entry, language))
-            if not os.path.exists(output_path):
-                continue
-            projects = load_data(language, 'dev')
-            df = pd.read_csv(os.path.join(output_path, 'results.csv'))
-            metrics_path = os.path.join(config.metrics_path, agent_name, language)
-            os.makedirs(metrics_path, exist_ok=True)
-            for _, dp in df.iterrows():
-                # get_quality_metrics(dp, config.repos_path, metrics_path)
-                # get_cost_metrics(dp, agent_name, metrics_path)
-                get_qodana_run_metrics(dp, language, metrics_path)
-                # await get_quality_compare_metrics(dp, projects, config.repos_path, metrics_path)
+    init_metric_engine(config.get('embeddings_path'))
+    await MetricsPipeline(config).run()
 
 
 @hydra.main(config_path="../../configs/template_generation", config_name="metrics", version_base=None)
@@ -0,0 +1,73 @@
+import asyncio
+import csv
+import os
+import shutil
+import time
+
+import hydra
+from dotenv import load_dotenv
+from hydra.core.hydra_config import HydraConfig
+from omegaconf import DictConfig
+
+from src.eval.agents.base_agent import BaseAgent
+from src.eval.agents.utils.journal_utils import trajectory_journal
+from src.eval.envs.base_env import BaseEnv
+
+
+async def replay_trajectory(agent: BaseAgent, env: BaseEnv, trajectory_path: str,
+                            project_template_path: str) -> dict[str, any]:
+    if os.path.exists(project_template_path):
+        shutil.rmtree(project_template_path)
+    os.makedirs(project_template_path)
+
+    with trajectory_journal(trajectory_path, replay=True) as journal:
+        await env.init({'content_root_path': project_template_path})
+        try:
+            start_time = time.time()
+            messages = await agent.run(env, journal.user_prompt)
+            end_time = time.time()
+        finally:
+            await env.shutdown()
+
+    return {
+        'trajectory_path': trajectory_path,
+        'project_template_path': project_template_path,
+        'time': end_time - start_time,
+        'steps_count': len(messages['intermediate_steps']),
+    }
+
+
+async def run_replay(agent: BaseAgent, env: BaseEnv, trajectories_path: str, output_path: str):
+    stats_path = os.path.join(output_path, 'replay_stats.csv')
+    for root, _, files in os.walk(trajectories_path):
+        config = os.path.relpath(root, trajectories_path)
+        for file in sorted(files):
+            if not file.endswith('.jsonl'):
+                continue
+            project_name = file[:-len('.jsonl')]
+            print(f"Replaying {config}/{project_name}")
+            stats = await replay_trajectory(agent, env, os.path.join(root, file),
+                                            os.path.join(output_path, config, 'gen_templates', project_name))
+            with open(stats_path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if f.tell() == 0:
+                    writer.writerow(stats.keys())
+                writer.writerow(stats.values())
+
+
+@hydra.main(config_path="../../configs/template_generation", config_name="replay.yaml", version_base="1.2")
+def main(cfg: DictConfig) -> None:
+    # Replay does not call the API, but chat models still require the key to be set
+    os.environ.setdefault('OPENAI_API_KEY', 'replay')
+
+    agent: BaseAgent = hydra.utils.instantiate(cfg.agent)
+    env: BaseEnv = hydra.utils.instantiate(cfg.env)
+    output_path = HydraConfig.get().run.dir
+
+    asyncio.run(run_replay(agent, env, cfg.trajectories_path, output_path))
+
+
+if __name__ == '__main__':
+    os.environ['HYDRA_FULL_ERROR'] = '1'
+    load_dotenv()
+    main()
@@ -0,0 +1,159 @@
+import dataclasses
+import difflib
+import hashlib
+import itertools
+import os
+from typing import Iterator, Optional
+
+DIFF_IGNORED_DIRS = {'.git'}
+MAX_FILE_SIZE = 1024 * 1024  # Larger files are compared by content hash only
+MAX_FILE_DIFF_SIZE = 64 * 1024
+MAX_DIFF_SIZE = 1024 * 1024
+
+
+@dataclasses.dataclass(frozen=True)
+class FileDiff:
+    """
+    Changes of a single file, line counts are not available for binary and too large files
+    """
+
+    path: str
+    status: str  # "added", "removed" or "modified"
+    content_type: str  # "text", "binary" or "too_large"
+    added_lines: Optional[int]
+    removed_lines: Optional[int]
+
+
+@dataclasses.dataclass(frozen=True)
+class DirectoryDiff:
+    """
+    Unified diff between two directories capped by size and per-file changes summary
+    """
+
+    diff: str
+    files: list[FileDiff]
+    truncated: bool
+
+    def get_stats(self) -> dict[str, int]:
+        """Returns counts of changed files by status and of added and removed lines of text files."""
+        stats = {'files_added': 0, 'files_removed': 0, 'files_modified': 0, 'lines_added': 0, 'lines_removed': 0}
+        for file in self.files:
+            stats[f'files_{file.status}'] += 1
+            stats['lines_added'] += file.added_lines or 0
+            stats['lines_removed'] += file.removed_lines or 0
+        return stats
+
+
+def _list_files(root_path: str) -> dict[str, str]:
+    files = {}
+    for dir_path, dir_names, file_names in os.walk(root_path):
+        dir_names[:] = [dir_name for dir_name in dir_names if dir_name not in DIFF_IGNORED_DIRS]
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            if os.path.isfile(file_path):
+                files[os.path.relpath(file_path, root_path)] = file_path
+    return files
+
+
+def _hash_file(file_path: str) -> str:
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _is_same_file(file_path_a: str, file_path_b: str) -> bool:
+    if os.path.getsize(file_path_a) != os.path.getsize(file_path_b):
+        return False
+    return _hash_file(file_path_a) == _hash_file(file_path_b)
+
+
+def _read_lines(file_path: Optional[str]) -> tuple[Optional[list[str]], str]:
+    """Returns lines of a text file and the content type, lines are None for binary and too large files."""
+    if file_path is None:
+        return [], 'text'
+    if os.path.getsize(file_path) > MAX_FILE_SIZE:
+        return None, 'too_large'
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    if b'\0' in content:
+        return None, 'binary'
+    try:
+        return content.decode().splitlines(keepends=True), 'text'
+    except UnicodeDecodeError:
+        return None, 'binary'
+
+
+def _iter_file_diff(path: str, file_path_a: Optional[str], file_path_b: Optional[str]) \
+        -> tuple[Iterator[str], str]:
+    (lines_a, content_type_a), (lines_b, content_type_b) = _read_lines(file_path_a), _read_lines(file_path_b)
+    header = [f'diff --git a/{path} b/{path}\n']
+    if 'too_large' in (content_type_a, content_type_b):
+        return iter(header + [f'Files a/{path} and b/{path} are too large to diff\n']), 'too_large'
+    if 'binary' in (content_type_a, content_type_b):
+        return iter(header + [f'Binary files a/{path} and b/{path} differ\n']), 'binary'
+    # File headers are written even if difflib yields nothing, e.g. for an added empty file
+    header += [f'--- a/{path}\n' if file_path_a is not None else '--- /dev/null\n',
+               f'+++ b/{path}\n' if file_path_b is not None else '+++ /dev/null\n']
+    hunk_lines = itertools.islice(difflib.unified_diff(lines_a, lines_b), 2, None)
+    return (line if line.endswith('\n') else f'{line}\n\\ No newline at end of file\n'
+            for lines in (header, hunk_lines) for line in lines), 'text'
+
+
+def diff_directories(path_a: str, path_b: str, max_file_diff_size: int = MAX_FILE_DIFF_SIZE,
+                     max_diff_size: int = MAX_DIFF_SIZE) -> DirectoryDiff:
+    """Builds a git-style unified diff of two directories without modifying them.
+
+    Files with identical contents are skipped, diff text of every file and of the whole diff is capped,
+    while the per-file added and removed line counts are always complete.
+    """
+    files_a, files_b = _list_files(path_a), _list_files(path_b)
+    diff_parts = []
+    diff_size = 0
+    truncated = False
+    files = []
+
+    for path in sorted(files_a.keys() | files_b.keys()):
+        file_path_a, file_path_b = files_a.get(path), files_b.get(path)
+        if file_path_a is not None and file_path_b is not None and _is_same_file(file_path_a, file_path_b):
+            continue
+
+        diff_lines, content_type = _iter_file_diff(path, file_path_a, file_path_b)
+        added_lines, removed_lines = 0, 0
+        file_diff_size = 0
+        file_truncated = False
+        in_hunk = False
+        for line in diff_lines:
+            if line.startswith('@@'):
+                in_hunk = True
+            elif in_hunk and line.startswith('+'):
+                added_lines += 1
+            elif in_hunk and line.startswith('-'):
+                removed_lines += 1
+            if file_truncated or file_diff_size + len(line) > max_file_diff_size \
+                    or diff_size + len(line) > max_diff_size:
+                file_truncated = True
+                continue
+            diff_parts.append(line)
+            file_diff_size += len(line)
+            diff_size += len(line)
+        if file_truncated:
+            truncated = True
+            if file_diff_size > 0:
+                diff_parts.append(f'... diff of {path} is truncated\n')
+
+        is_text = content_type == 'text'
+        files.append(FileDiff(
+            path=path,
+            status='added' if file_path_a is None else 'removed' if file_path_b is None else 'modified',
+            content_type=content_type,
+            added_lines=added_lines if is_text else None,
+            removed_lines=removed_lines if is_text else None,
+        ))
+
+    return DirectoryDiff(diff=''.join(diff_parts), files=files, truncated=truncated)
+
+
+def get_diff_between_directories(actual_project_path: str, gen_project_path: str) -> str:
+    return diff_directories(actual_project_path, gen_project_path).diff
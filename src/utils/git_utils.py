@@ -3,8 +3,6 @@ import os
 import subprocess
 from typing import Optional
 
-from git import Repo
-
 
 async def clone_repo(repo_owner: str, repo_name: str, repo_dir: str) -> Optional[Exception]:
     if os.path.exists(repo_dir):
@@ -20,14 +18,3 @@ async def clone_repo(repo_owner: str, repo_name: str, repo_dir: str) -> Optional
         print(f"Failed to clone repository {repo_owner}__{repo_name}", e)
         return e
 
-
-def get_diff_between_directories(actual_project_path: str, gen_project_path: str) -> str:
-    repo_a = Repo.init(actual_project_path)
-    repo_b = Repo.init(gen_project_path)
-
-    result = subprocess.run(["git", "diff", "--no-index", actual_project_path, gen_project_path],
-                            capture_output=True,
-                            text=True)
-    diff = result.stdout
-
-    return diff
@@ -1,12 +1,16 @@
 import asyncio
+import dataclasses
 import logging
 import os
+import time
 from enum import Enum
-from typing import Optional, Callable, Any
+from typing import Optional, Callable, Coroutine
 
 import aiohttp
 
 from src.utils.jsonl_utils import append_to_jsonl
+from src.utils.github.github_http_cache import GithubHttpCache
+from src.utils.github.github_token_pool import GithubTokenPool
 from src.utils.github.github_utils import make_github_http_request, clone_repo, GITHUB_API_URL
 
 logger = logging.getLogger(__name__)
@@ -25,91 +29,232 @@ class LoadTarget(Enum):
         return self.value
 
 
+@dataclasses.dataclass
+class ConnectionStats:
+    """
+    Counters of HTTP requests and of connections opened or taken from the keep-alive pool to serve them
+    """
+
+    requests: int = 0
+    connections_created: int = 0
+    connections_reused: int = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        connections = self.connections_created + self.connections_reused
+        return self.connections_reused / connections if connections > 0 else 0.0
+
+
+@dataclasses.dataclass
+class LoadProgress:
+    """
+    Progress of a load: processed repositories, loaded API pages and repositories failed with an error
+    """
+
+    target: str
+    repos_total: int
+    repos_done: int = 0
+    pages: int = 0
+    errors: int = 0
+    start_time: float = dataclasses.field(default_factory=time.monotonic)
+
+    def get_report(self) -> str:
+        elapsed_time = max(time.monotonic() - self.start_time, 1e-9)
+        return (f"Loading {self.target}: {self.repos_done}/{self.repos_total} repos, {self.errors} errors, "
+                f"{self.repos_done / elapsed_time:.2f} repos/s, {self.pages / elapsed_time:.2f} pages/s")
+
+
+DEFAULT_TARGET_CONCURRENCY = {
+    'meta': 20,
+    'data': 20,
+    'clone': 4,
+}
+
+
 class GithubDataProvider:
+    """Loads repositories data from GitHub API through one connection-pooled HTTP session per load.
+
+    All requests of a load share the session connector, so connections to the API host are kept alive and reused
+    across repositories and pages instead of paying a new TCP and TLS handshake for every repository. Every request
+    takes the token with the most rate limit budget from the token pool.
+
+    Repositories are processed by a sliding window of workers, so a new repository starts as soon as any other one is
+    finished. The window size is `concurrency` capped by the per-target limit of metadata, data pages or clone loads.
 
-    def __init__(self, github_tokens: Optional[list[str]] = None, batch_size: int = 20, per_page: int = 100):
-        self.batch_size = batch_size
+    If `http_cache_path` is set, responses are cached with their validators and requested conditionally on the next
+    loads, so unchanged repositories and pages are refreshed without spending the rate limit.
+    """
+
+    def __init__(
+            self,
+            github_tokens: Optional[list[str]] = None,
+            concurrency: int = 20,
+            target_concurrency: Optional[dict[str, int]] = None,
+            progress_interval: float = 30,
+            per_page: int = 100,
+            connection_limit: int = 100,
+            connection_limit_per_host: int = 20,
+            dns_cache_ttl: int = 300,
+            keepalive_timeout: float = 60,
+            api_url: str = GITHUB_API_URL,
+            http_cache_path: Optional[str] = None,
+    ):
+        self.concurrency = concurrency
+        self.target_concurrency = {**DEFAULT_TARGET_CONCURRENCY, **(target_concurrency or {})}
+        self.progress_interval = progress_interval
         self.per_page = per_page
         self.github_tokens = github_tokens
+        self.token_pool = GithubTokenPool(github_tokens if github_tokens else [None])
+        self.api_url = api_url
+        self.http_cache_path = http_cache_path
+        self.connection_limit = connection_limit
+        self.connection_limit_per_host = connection_limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.connection_stats = ConnectionStats()
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._http_cache: Optional[GithubHttpCache] = None
+        self._progress: Optional[LoadProgress] = None
+
+    def get_connection_stats(self) -> ConnectionStats:
+        return dataclasses.replace(self.connection_stats)
+
+    def _create_trace_config(self) -> aiohttp.TraceConfig:
+        async def on_request_start(session, context, params):
+            self.connection_stats.requests += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.connection_stats.connections_created += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.connection_stats.connections_reused += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def _create_http_session(self) -> aiohttp.ClientSession:
+        # Sessions are bound to the event loop, so a session is created inside every `asyncio.run`
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            limit_per_host=self.connection_limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        return aiohttp.ClientSession(connector=connector, trace_configs=[self._create_trace_config()])
+
+    async def _with_http_session(self, load: Coroutine):
+        async with self._create_http_session() as http_session:
+            self._http_session = http_session
+            if self.http_cache_path is not None:
+                self._http_cache = GithubHttpCache(self.http_cache_path)
+            try:
+                return await load
+            finally:
+                self._http_session = None
+                if self._http_cache is not None:
+                    self._http_cache.close()
+                    self._http_cache = None
+                stats = self.connection_stats
+                logger.info(f"Made {stats.requests} requests, created {stats.connections_created} connections, "
+                            f"reused {stats.connections_reused} connections ({stats.reuse_ratio:.1%})")
 
     def load_repos_data(self, repos: list[tuple[str, str]], load_target: LoadTarget, data_path: str):
         os.makedirs(data_path, exist_ok=True)
-        asyncio.run(
-            self._load_by_batch(
+        asyncio.run(self._with_http_session(
+            self._load_concurrently(
+                'data',
                 repos,
-                lambda repo_owner, repo_name, github_token:
-                self._load_repo_data_by_page(repo_owner, repo_name, github_token, load_target, data_path)
+                lambda repo_owner, repo_name:
+                self._load_repo_data_by_page(repo_owner, repo_name, load_target, data_path)
             )
-        )
+        ))
 
     def load_repos_meta(self, repos: list[tuple[str, str]], data_path: str):
-        asyncio.run(
-            self._load_by_batch(
+        asyncio.run(self._with_http_session(
+            self._load_concurrently(
+                'meta',
                 repos,
-                lambda repo_owner, repo_name, github_token:
-                self._load_repo_meta(repo_owner, repo_name, github_token, data_path)
+                lambda repo_owner, repo_name:
+                self._load_repo_meta(repo_owner, repo_name, data_path)
             )
-        )
+        ))
 
     def clone_repos(self, repos: list[tuple[str, str]], data_path: str):
         os.makedirs(data_path, exist_ok=True)
         asyncio.run(
-            self._load_by_batch(
+            self._load_concurrently(
+                'clone',
                 repos,
-                lambda repo_owner, repo_name, github_token:
-                self._clone_repo(repo_owner, repo_name, github_token, data_path)
+                lambda repo_owner, repo_name:
+                self._clone_repo(repo_owner, repo_name, data_path)
             )
         )
 
-    def _batch(self, lst: list[Any]):
-        for i in range(0, len(lst), self.batch_size):
-            yield lst[i:i + self.batch_size]
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            logger.info(self._progress.get_report())
 
-    async def _load_by_batch(
+    async def _load_concurrently(
             self,
+            target: str,
             repos: list[tuple[str, str]],
-            task: Callable[[str, str, str], Any]
+            task: Callable[[str, str], Coroutine]
     ):
-        for repos_butch in self._batch(repos):
-            prepare_repositories_coroutines = []
-            tokens_count = len(self.github_tokens)
-            for i, repo in enumerate(repos_butch):
-                repo_owner, repo_name = repo
-                github_token = self.github_tokens[i % tokens_count] if self.github_tokens is not None else None
-                prepare_repositories_coroutines.append(
-                    task(repo_owner, repo_name, github_token)
-                )
-            for repositories_future in asyncio.as_completed(prepare_repositories_coroutines):
-                await repositories_future
-
-    @staticmethod
-    async def _load_repo_meta(repo_owner: str, repo_name: str, github_token: str, data_path: str):
+        self._progress = LoadProgress(target, len(repos))
+        workers_count = min(self.concurrency, self.target_concurrency.get(target, self.concurrency), len(repos))
+        # Workers share the iterator and take the next repository once their current one is finished
+        repos_iter = iter(repos)
+
+        async def worker():
+            for repo_owner, repo_name in repos_iter:
+                try:
+                    result = await task(repo_owner, repo_name)
+                except Exception as e:
+                    logger.error(f"Failed to process {repo_owner}/{repo_name}: {e}")
+                    result = e
+                self._progress.repos_done += 1
+                if isinstance(result, Exception):
+                    self._progress.errors += 1
+
+        progress_reporter = asyncio.create_task(self._report_progress())
         try:
-            async with (aiohttp.ClientSession() as http_session):
-                logger.info(f"Started processing {repo_owner}/{repo_name}")
-                data_url = f"{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}"
-                github_api_response_or_error = \
-                    await make_github_http_request(http_session, github_token, data_url)
+            await asyncio.gather(*(worker() for _ in range(workers_count)))
+        finally:
+            progress_reporter.cancel()
+            logger.info(self._progress.get_report())
 
-                if isinstance(github_api_response_or_error, Exception):
-                    logger.error(f"Failed to process {repo_owner}/{repo_name}",
-                                 github_api_response_or_error)
-                    return github_api_response_or_error
+    async def _load_repo_meta(self, repo_owner: str, repo_name: str, data_path: str):
+        try:
+            logger.info(f"Started processing {repo_owner}/{repo_name}")
+            data_url = f"{self.api_url}/repos/{repo_owner}/{repo_name}"
+            github_api_response_or_error = \
+                await make_github_http_request(self._http_session, None, data_url,
+                                               token_pool=self.token_pool, http_cache=self._http_cache)
 
-                if github_api_response_or_error is None:
-                    return
+            if isinstance(github_api_response_or_error, Exception):
+                logger.error(f"Failed to process {repo_owner}/{repo_name}",
+                             github_api_response_or_error)
+                return github_api_response_or_error
 
-                data = github_api_response_or_error.data
-                append_to_jsonl([data], data_path)
-                logger.info(f"Successfully finished processing {repo_owner}/{repo_name}")
+            if github_api_response_or_error is None:
+                return
+
+            self._progress.pages += 1
+            data = github_api_response_or_error.data
+            append_to_jsonl([data], data_path)
+            logger.info(f"Successfully finished processing {repo_owner}/{repo_name}")
         except asyncio.exceptions.TimeoutError as e:
             logger.error(f"Failed to process {repo_owner}/{repo_name}", e)
+            return e
 
     async def _load_repo_data_by_page(
             self,
             repo_owner: str,
             repo_name: str,
-            github_token: str,
             load_target: LoadTarget,
             data_path: str
     ):
@@ -119,36 +264,38 @@ class GithubDataProvider:
             return
         try:
             logger.info(f"Started processing {repo_owner}/{repo_name}")
-            current_url = f"{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/{load_target}?per_page={self.per_page}&state=all"
-            async with (aiohttp.ClientSession() as http_session):
-                while current_url is not None:
-                    github_api_response_or_error = \
-                        await make_github_http_request(http_session, github_token, current_url)
-
-                    if isinstance(github_api_response_or_error, Exception):
-                        logger.error(f"Finished processing {repo_owner}/{repo_name} with exception",
-                                     github_api_response_or_error)
-                        return github_api_response_or_error
-
-                    data = github_api_response_or_error.data
-                    append_to_jsonl(data, data_path)
-
-                    # Actual for actions not to load after some date
-                    if len(data) < self.per_page:
-                        current_url = None
-                    else:
-                        current_url = github_api_response_or_error.headers.get("next", None)
-
-                logger.info(f"Successfully finished processing {repo_owner}/{repo_name}")
+            current_url = f"{self.api_url}/repos/{repo_owner}/{repo_name}/{load_target}?per_page={self.per_page}&state=all"
+            while current_url is not None:
+                github_api_response_or_error = \
+                    await make_github_http_request(self._http_session, None, current_url,
+                                                   token_pool=self.token_pool, http_cache=self._http_cache)
+
+                if isinstance(github_api_response_or_error, Exception):
+                    logger.error(f"Finished processing {repo_owner}/{repo_name} with exception",
+                                 github_api_response_or_error)
+                    return github_api_response_or_error
+
+                self._progress.pages += 1
+                data = github_api_response_or_error.data
+                append_to_jsonl(data, data_path)
+
+                # Actual for actions not to load after some date
+                if len(data) < self.per_page:
+                    current_url = None
+                else:
+                    current_url = github_api_response_or_error.headers.get("next", None)
+
+            logger.info(f"Successfully finished processing {repo_owner}/{repo_name}")
         except asyncio.exceptions.TimeoutError as e:
             logger.error(f"Failed to process {repo_owner}/{repo_name}", e)
+            return e
 
         return None
 
-    @staticmethod
-    async def _clone_repo(repo_owner: str, repo_name: str, github_token: str, data_path: str) -> Optional[Exception]:
+    async def _clone_repo(self, repo_owner: str, repo_name: str, data_path: str) -> Optional[Exception]:
         repo_dir = f"{data_path}/{repo_owner}__{repo_name}"
         if os.path.exists(repo_dir):
             print(f"Repo {repo_owner}/{repo_name} has been already cloned")
             return None
-        return await clone_repo(repo_owner, repo_name, github_token, repo_dir)
+        # Cloning does not consume API rate limit, so no request is reserved
+        return await clone_repo(repo_owner, repo_name, self.token_pool.get_token(), repo_dir)
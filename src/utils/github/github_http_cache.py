@@ -0,0 +1,81 @@
+import dataclasses
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Any, Iterable, Optional
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedGithubResponse:
+    """
+    Github API response body stored with its validators and the "next" header for the conditional requests
+    """
+
+    etag: Optional[str]
+    last_modified: Optional[str]
+    data: Any
+    headers: dict
+
+    def get_conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class GithubHttpCache:
+    """Persistent SQLite cache of Github API responses keyed by URL and token.
+
+    Responses are stored with their `ETag` and `Last-Modified` validators, so the next request of the same URL is
+    sent conditionally and a 304 answer, which does not count against the rate limit, is served from the cache.
+    Github responses and their validators depend on the authorization (e.g. repository `permissions`), so entries
+    are kept per token, tokens themselves are stored only as hashes.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'url TEXT NOT NULL, token_key TEXT NOT NULL, etag TEXT, last_modified TEXT, '
+                'data TEXT NOT NULL, headers TEXT NOT NULL, PRIMARY KEY (url, token_key))'
+            )
+
+    @staticmethod
+    def get_token_key(github_token: Optional[str]) -> str:
+        return hashlib.sha256(str(github_token).encode()).hexdigest()
+
+    def get_cached_tokens(self, url: str, github_tokens: Iterable[Optional[str]]) -> list[Optional[str]]:
+        """Returns the tokens which have a cached response for the URL."""
+        with self._lock:
+            token_keys = {token_key for token_key, in self._connection.execute(
+                'SELECT token_key FROM responses WHERE url = ?', (url,))}
+        return [github_token for github_token in github_tokens if self.get_token_key(github_token) in token_keys]
+
+    def get(self, url: str, github_token: Optional[str]) -> Optional[CachedGithubResponse]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT etag, last_modified, data, headers FROM responses WHERE url = ? AND token_key = ?',
+                (url, self.get_token_key(github_token))).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, data, headers = row
+        return CachedGithubResponse(etag, last_modified, json.loads(data), json.loads(headers))
+
+    def update(self, url: str, github_token: Optional[str], etag: Optional[str], last_modified: Optional[str],
+               data: Any, headers: dict):
+        if etag is None and last_modified is None:
+            return
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses (url, token_key, etag, last_modified, data, headers) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, self.get_token_key(github_token), etag, last_modified, json.dumps(data), json.dumps(headers)))
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,90 @@
+import asyncio
+import dataclasses
+import logging
+import time
+from typing import Optional, Sequence
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_RATE_LIMIT = 5000  # Primary rate limit of an authenticated user, assumed until the token reports its own
+
+
+@dataclasses.dataclass
+class TokenBudget:
+    """
+    Primary rate limit budget of a token as last reported by Github API, remaining is None until the first response
+    or after the reset time has passed
+    """
+
+    remaining: Optional[int] = None
+    reset_time: float = 0.0
+    in_flight: int = 0
+
+    def get_available(self, now: float) -> int:
+        if self.remaining is None or self.reset_time <= now:
+            return DEFAULT_RATE_LIMIT - self.in_flight
+        return self.remaining - self.in_flight
+
+
+class GithubTokenPool:
+    """Dispatches Github API requests to the token with the most remaining primary rate limit budget.
+
+    Budgets are updated from `X-RateLimit-Remaining` and `X-RateLimit-Reset` headers of every response, requests in
+    flight are reserved from the budget of their token. When every token is exhausted, only the requests asking for
+    a token wait until the earliest reset, the others keep running.
+    """
+
+    def __init__(self, github_tokens: list[Optional[str]]):
+        if len(github_tokens) == 0:
+            raise ValueError("Token pool requires at least one token")
+        self._budgets: dict[Optional[str], TokenBudget] = {token: TokenBudget() for token in github_tokens}
+
+    def get_token(self) -> Optional[str]:
+        """Returns the token with the most budget without reserving a request."""
+        now = time.time()
+        return max(self._budgets, key=lambda token: self._budgets[token].get_available(now))
+
+    @property
+    def tokens(self) -> list[Optional[str]]:
+        return list(self._budgets)
+
+    async def acquire(self, preferred_tokens: Sequence[Optional[str]] = ()) -> Optional[str]:
+        """Reserves a request from the token with the most budget, waits for a reset if all tokens are exhausted.
+
+        Preferred tokens (e.g. the ones with cached responses to revalidate) are taken first while they have budget.
+        """
+        while True:
+            now = time.time()
+            for token in preferred_tokens:
+                budget = self._budgets[token]
+                if budget.get_available(now) > 0:
+                    budget.in_flight += 1
+                    return token
+            token = self.get_token()
+            budget = self._budgets[token]
+            if budget.get_available(now) > 0:
+                budget.in_flight += 1
+                return token
+
+            reset_time = min(budget.reset_time for budget in self._budgets.values())
+            sleep_time = max(reset_time - now, 1)
+            logger.warning(f"All {len(self._budgets)} Github tokens are exhausted, waiting {sleep_time:.0f}s for reset")
+            await asyncio.sleep(sleep_time)
+
+    def release(self, token: Optional[str], remaining: Optional[int] = None, reset_time: Optional[float] = None):
+        """Returns a reserved request and updates the token budget with rate limit headers of its response if any."""
+        budget = self._budgets[token]
+        budget.in_flight = max(budget.in_flight - 1, 0)
+        if remaining is not None and reset_time is not None:
+            # Responses may arrive out of order, the smaller remaining of one window is the most recent
+            if reset_time > budget.reset_time or reset_time == budget.reset_time and (
+                    budget.remaining is None or remaining < budget.remaining):
+                budget.remaining = remaining
+                budget.reset_time = reset_time
+
+    def exhaust(self, token: Optional[str], reset_time: float):
+        """Marks the token as having no budget until the reset time."""
+        budget = self._budgets[token]
+        budget.remaining = 0
+        budget.reset_time = reset_time
@@ -10,6 +10,9 @@ from urllib.parse import urlparse
 import aiohttp
 from tenacity import after_log, before_sleep_log, retry, retry_if_result, stop_after_attempt, wait_fixed
 
+from src.utils.github.github_http_cache import GithubHttpCache
+from src.utils.github.github_token_pool import GithubTokenPool
+
 GITHUB_API_TRIES_LIMIT = 10
 OTHER_ERRORS_SLEEP_TIME = 10
 TIME_DIVERGENCE_CONST = 300
@@ -23,6 +26,7 @@ Github API specific headers
 """
 RETRY_AFTER = "Retry-After"  # Indicates when the request should be retried after hitting secondary rate limit
 X_RATELIMIT_RESET = "X-RateLimit-Reset"  # Indicates when the primary rate limit will be reset
+X_RATELIMIT_REMAINING = "X-RateLimit-Remaining"  # Indicates the number of requests left until the reset
 
 
 @dataclasses.dataclass(frozen=True)
@@ -59,10 +63,12 @@ class GithubApiRequestQuery:
 class GithubApiResponse:
     """
     Basic Github API response with one header "next" (link to the next page of results in search) if it exists
+    and remaining requests and reset time of the primary rate limit if they are reported
     """
 
     data: dict
     headers: dict
+    rate_limit: Tuple[Optional[int], Optional[int]] = (None, None)
 
 
 @dataclasses.dataclass(frozen=True)
@@ -94,6 +100,12 @@ class NotRetryableGithubApiError(Exception):
     pass
 
 
+class GithubRateLimitError(GithubApiError):
+    def __init__(self, message: str, reset_time: int):
+        super().__init__(message)
+        self.reset_time = reset_time
+
+
 # General requests methods
 def return_last_value(retry_state):
     """return the result of the last call attempt"""
@@ -104,9 +116,24 @@ def return_last_value(retry_state):
     return retry_state.outcome.result()
 
 
+def wait_other_errors(retry_state) -> float:
+    """primary rate limit errors are retried at once with another token, the token pool waits for the reset"""
+    if not retry_state.outcome.failed and isinstance(retry_state.outcome.result(), GithubRateLimitError):
+        return 0
+    return wait_fixed(OTHER_ERRORS_SLEEP_TIME)(retry_state)
+
+
+def get_rate_limit(response: aiohttp.ClientResponse) -> tuple[Optional[int], Optional[int]]:
+    """return remaining requests and reset time of the primary rate limit if the response reports them"""
+    try:
+        return int(response.headers[X_RATELIMIT_REMAINING]), int(response.headers[X_RATELIMIT_RESET])
+    except (KeyError, ValueError):
+        return None, None
+
+
 @retry(
     reraise=True,
-    wait=wait_fixed(OTHER_ERRORS_SLEEP_TIME),
+    wait=wait_other_errors,
     stop=stop_after_attempt(GITHUB_API_TRIES_LIMIT),
     retry=retry_if_result(lambda res: isinstance(res, Exception) and not isinstance(res, NotRetryableGithubApiError)),
     before_sleep=before_sleep_log(logger, logging.INFO),
@@ -115,24 +142,58 @@ def return_last_value(retry_state):
 )
 async def make_github_http_request(
         http_session: aiohttp.ClientSession,
-        github_token: str,
+        github_token: Optional[str],
         url: str,
+        token_pool: Optional[GithubTokenPool] = None,
+        http_cache: Optional[GithubHttpCache] = None,
 ) -> GithubApiResponseOrError:
     """
     Make http request for specified url with github authorization and return http response body
     or throw an aggregated error.
     :param http_session: http session
-    :param github_token: GitHub auth token
+    :param github_token: GitHub auth token, used if no token pool is given
     :param url: url to open
+    :param token_pool: pool to take the token with the most rate limit budget from on every attempt
+    :param http_cache: cache to send conditional requests with and to serve not modified responses from
     :return: response body and important headers or throws an exception
     """
 
+    if token_pool is None:
+        return await _make_github_http_request(http_session, github_token, url, http_cache=http_cache)
+
+    # Validators of cached responses are per token, so a token which can revalidate the response is preferred
+    cached_tokens = http_cache.get_cached_tokens(url, token_pool.tokens) if http_cache is not None else []
+    github_token = await token_pool.acquire(cached_tokens)
+    remaining, reset_time = None, None
+    try:
+        response_or_error = await _make_github_http_request(http_session, github_token, url, http_cache=http_cache,
+                                                            wait_for_reset=False)
+        if isinstance(response_or_error, GithubRateLimitError):
+            token_pool.exhaust(github_token, response_or_error.reset_time)
+        elif isinstance(response_or_error, GithubApiResponse):
+            remaining, reset_time = response_or_error.rate_limit
+        return response_or_error
+    finally:
+        token_pool.release(github_token, remaining, reset_time)
+
+
+async def _make_github_http_request(
+        http_session: aiohttp.ClientSession,
+        github_token: Optional[str],
+        url: str,
+        http_cache: Optional[GithubHttpCache] = None,
+        wait_for_reset: bool = True,
+) -> GithubApiResponseOrError:
     headers = {
         "Authorization": f"token {github_token}",
         # "Accept": "application/vnd.github.mercy-preview+json",  # allows to retrieve topics from repositories
         "Accept": "application/vnd.github+json",
         # according to the recommendation https://docs.github.com/en/rest/actions/workflow-runs?apiVersion=2022-11-28
     }
+    cached_response = http_cache.get(url, github_token) if http_cache is not None else None
+    if cached_response is not None:
+        # 304 answers to conditional requests do not count against the rate limit
+        headers.update(cached_response.get_conditional_headers())
 
     try:
         logger.debug(f"Trying to make a request: {url}")
@@ -143,19 +204,29 @@ async def make_github_http_request(
                 response_headers = {}
                 if "next" in response.links and "url" in response.links["next"]:
                     response_headers["next"] = response.links["next"]["url"]
-                return GithubApiResponse(await response.json(), response_headers)
+                data = await response.json()
+                if http_cache is not None:
+                    http_cache.update(url, github_token, response.headers.get("ETag"),
+                                      response.headers.get("Last-Modified"), data, response_headers)
+                return GithubApiResponse(data, response_headers, get_rate_limit(response))
+
+            if status_code == 304 and cached_response is not None:
+                logger.debug(f"Not modified: {url}")
+                return GithubApiResponse(cached_response.data, cached_response.headers, get_rate_limit(response))
 
             if status_code == 301:
                 # Sometimes action requests are redirected.
                 url_redirected = response.headers["Location"]
-                return await make_github_http_request(http_session, github_token, url_redirected)
+                return await make_github_http_request(http_session, github_token, url_redirected,
+                                                     http_cache=http_cache)
 
             if status_code == 302:  # the URL is redirected if we download logs.
                 url_redirected = response.headers["Location"]
-                return await make_github_http_request(http_session, github_token, url_redirected)
+                return await make_github_http_request(http_session, github_token, url_redirected,
+                                                     http_cache=http_cache)
 
             elif status_code == 403:
-                return await handle_github_rate_limit(response)
+                return await handle_github_rate_limit(response, wait_for_reset)
 
             elif status_code == 504:
                 return await handle_github_ban(response)
@@ -189,11 +260,15 @@ async def handle_github_ban(response: aiohttp.ClientResponse) -> GithubApiError:
     return GithubApiError(error_message)
 
 
-async def handle_github_rate_limit(response: aiohttp.ClientResponse) -> GithubApiError:
+async def handle_github_rate_limit(
+        response: aiohttp.ClientResponse,
+        wait_for_reset: bool = True
+) -> Union[GithubApiError, NotRetryableGithubApiError]:
     """
     Rate limit errors from github have 403 HTTP status. This method handles rate limit errors and propagates other errors.
     To fix exceeded rate limit this method performs a delay before making the next call.
     :param response: http response
+    :param wait_for_reset: whether to wait for the primary rate limit reset or leave it to the token pool
     :return: an error about rate limiting or an error during parsing the response
     """
     response_json = await response.json()
@@ -212,6 +287,18 @@ async def handle_github_rate_limit(response: aiohttp.ClientResponse) -> GithubAp
             reset_time = int(response.headers[X_RATELIMIT_RESET])
             #  add some time because of possible time divergence
             sleep_time = reset_time - int(time.time()) + TIME_DIVERGENCE_CONST
+            if not wait_for_reset:
+                error_message = f"Github API rate limit was exceeded. {response.url} token is exhausted for {sleep_time}"
+                logger.warning(error_message)
+                return GithubRateLimitError(error_message, reset_time + TIME_DIVERGENCE_CONST)
+            error_message = f"Github API rate limit was exceeded. {response.url} sleep for {sleep_time}"
+            logger.warning(error_message)
+            await asyncio.sleep(max(sleep_time, 0))
+            return GithubApiError(error_message)
+
+    error_message = f"Github API returned 403 error for {response.url}: {response_json.get('message')}"
+    logger.error(error_message)
+    return NotRetryableGithubApiError(error_message)
 
 
 def parse_github_url(url: str) -> Tuple[str, str]:
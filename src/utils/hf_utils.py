@@ -1,4 +1,5 @@
 import os
+import re
 
 import datasets
 import huggingface_hub
@@ -7,6 +8,21 @@ from datasets import Dataset
 HUGGINGFACE_REPO = 'JetBrains-Research/template-generation'
 CATEGORIES = ['java', 'kt', 'py', 'android']
 SPLITS = ['dev', 'test', 'train']
+# Profiles of TokenizationUtils for which the dataset contains extra token counts
+TOKENIZATION_PROFILES = ['deepseek-ai/deepseek-coder-1.3b-instruct', 'chat-llama-v2-7b']
+TOKENS_COUNT_PREFIXES = ['repo', 'repo_code', 'description', 'readme']
+
+
+def get_profile_column_suffix(profile_name: str) -> str:
+    return re.sub(r'[^0-9a-zA-Z]+', '_', profile_name).strip('_').lower()
+
+
+def get_profile_columns(profile_name: str) -> dict[str, str]:
+    suffix = get_profile_column_suffix(profile_name)
+    columns = {f'{prefix}_tokens_count_{suffix}': 'int64' for prefix in TOKENS_COUNT_PREFIXES}
+    columns[f'repo_fits_context_{suffix}'] = 'bool'
+    return columns
+
 
 FEATURES = {
     'repos_paths': datasets.Features(
@@ -53,6 +69,11 @@ FEATURES = {
             "readme_tokens_count": datasets.Value("int64"),
             "readme_words_count": datasets.Value("int64"),
             "readme_lines_count": datasets.Value("int64"),
+            **{
+                column: datasets.Value(dtype)
+                for profile_name in TOKENIZATION_PROFILES
+                for column, dtype in get_profile_columns(profile_name).items()
+            },
         }
     ),
     'ide_template_generation_data': datasets.Features(
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+MERKLE_IGNORED_DIRS = {'.git'}
+
+
+class MetricsMemo:
+    """SQLite memo of metric computations keyed by Merkle hashes of the generated and golden projects.
+
+    A metric family result of a project is fresh while the family version and both project hashes are unchanged.
+    File hashes are cached by path, size and modification time, so unchanged trees are re-hashed without reading
+    file contents.
+    """
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS metrics ('
+                'family TEXT NOT NULL, id TEXT NOT NULL, version INTEGER NOT NULL, '
+                'gen_hash TEXT NOT NULL, golden_hash TEXT NOT NULL, PRIMARY KEY (family, id))'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS file_hashes ('
+                'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL)'
+            )
+
+    def get(self, family: str, project_id) -> Optional[tuple[int, str, str]]:
+        with self._lock:
+            return self._connection.execute(
+                'SELECT version, gen_hash, golden_hash FROM metrics WHERE family = ? AND id = ?',
+                (family, str(project_id))).fetchone()
+
+    def update(self, family: str, project_id, version: int, gen_hash: str, golden_hash: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO metrics (family, id, version, gen_hash, golden_hash) VALUES (?, ?, ?, ?, ?)',
+                (family, str(project_id), version, gen_hash, golden_hash))
+
+    def _hash_file(self, file_path: str, stat: os.stat_result) -> str:
+        with self._lock:
+            row = self._connection.execute('SELECT size, mtime_ns, hash FROM file_hashes WHERE path = ?',
+                                           (file_path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        file_hash = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                file_hash.update(chunk)
+        with self._lock:
+            # Committed once the whole tree is hashed
+            self._connection.execute('INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, hash) '
+                                     'VALUES (?, ?, ?, ?)',
+                                     (file_path, stat.st_size, stat.st_mtime_ns, file_hash.hexdigest()))
+        return file_hash.hexdigest()
+
+    def hash_directory(self, dir_path: str) -> str:
+        """Returns the Merkle hash of the directory, an empty string if it does not exist."""
+        if not os.path.isdir(dir_path):
+            return ''
+        dir_hash = self._hash_directory(dir_path)
+        with self._lock:
+            self._connection.commit()
+        return dir_hash
+
+    def _hash_directory(self, dir_path: str) -> str:
+        entries = []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in MERKLE_IGNORED_DIRS:
+                        continue
+                    entries.append(f'd {entry.name} {self._hash_directory(entry.path)}')
+                elif entry.is_file():
+                    entries.append(f'f {entry.name} {self._hash_file(os.path.abspath(entry.path), entry.stat())}')
+        return hashlib.sha256('\n'.join(sorted(entries)).encode()).hexdigest()
+
+    def close(self):
+        self._connection.close()
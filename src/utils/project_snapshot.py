@@ -0,0 +1,214 @@
+import codecs
+import dataclasses
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+MEDIA_EXTENSIONS = {'.jpg', '.png', '.gif', '.jpeg', '.svg', '.bmp', '.tiff', '.webp', '.heic', '.psd', '.raw', '.mp3',
+                    '.mp4', '.mov', '.wmv', '.avi', '.mkv'}
+MAX_TEXT_FILE_SIZE = 8 * 1024 * 1024  # Larger files are not treated as text
+TEXT_CACHE_SIZE = 64 * 1024 * 1024  # Decoded contents of recently read files kept by each snapshot view
+SNIFF_SIZE = 8192
+
+
+@dataclasses.dataclass(frozen=True)
+class SnapshotFile:
+    """
+    File of a project snapshot with stat data collected during the scan, size is None for broken links
+    """
+
+    path: str
+    name: str
+    size: Optional[int]
+    mtime_ns: Optional[int]
+
+
+@dataclasses.dataclass(frozen=True)
+class SnapshotDir:
+    """
+    Directory of a project snapshot with its depth relative to the project root and its direct children
+    """
+
+    path: str
+    name: str
+    depth: int
+    dir_names: list[str]
+    files: list[SnapshotFile]
+
+
+def is_hidden(name: str) -> bool:
+    return name.startswith('.')
+
+
+def is_media(name: str) -> bool:
+    return os.path.splitext(name)[1] in MEDIA_EXTENSIONS
+
+
+def is_text_file(file: SnapshotFile, max_size: int = MAX_TEXT_FILE_SIZE) -> bool:
+    """Sniffs the beginning of the file, files with NUL bytes or invalid UTF-8 and too large files are skipped."""
+    if file.size is None or file.size > max_size:
+        return False
+    try:
+        with open(file.path, 'rb') as f:
+            head = f.read(SNIFF_SIZE)
+    except OSError as e:
+        print(f"Can not read file {file.path}", e)
+        return False
+    if b'\0' in head:
+        return False
+    try:
+        # A multibyte character may be cut at the end of a partially read file
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=len(head) < SNIFF_SIZE)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def read_text_file(file: SnapshotFile) -> Optional[str]:
+    try:
+        with open(file.path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+    except (OSError, ValueError) as e:
+        print(f"Can not read file {file.path}", e)
+        return None
+
+
+class LazyTextContents(Mapping):
+    """Read-only mapping of text file paths to their contents, which are read from disk on access.
+
+    Decoded contents of recently read files are kept in an LRU cache bounded by `cache_size` bytes, so metrics
+    walking the same contents do not re-read files, while contents of a whole large repository are never resident.
+    """
+
+    def __init__(self, files: list[SnapshotFile], cache_size: int = TEXT_CACHE_SIZE):
+        self._files = {str(Path(file.path)): file for file in files}
+        self._cache_size = cache_size
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._cached_size = 0
+        self._lock = threading.Lock()
+
+    def __getitem__(self, path: str) -> str:
+        file = self._files[path]
+        with self._lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                return self._cache[path]
+
+        content = read_text_file(file)
+        content = content if content is not None else ''
+        size = len(content)
+        if size > self._cache_size:
+            return content
+        with self._lock:
+            if path not in self._cache:
+                self._cache[path] = content
+                self._cached_size += size
+                while self._cached_size > self._cache_size:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_size -= len(evicted)
+        return content
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._files)
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def get_size(self, path: str) -> int:
+        return self._files[path].size
+
+
+class ProjectSnapshot:
+    """Project directory scanned once with `os.scandir` and shared by file tree, content and file metrics utilities.
+
+    The scan records every directory top-down like `os.walk` together with stat data of files, symlinked
+    directories are listed but not entered. Hidden and media files are filtered by the views, binary and too large
+    files are excluded from text contents, which are read on access and cached up to a bounded size.
+    """
+
+    def __init__(self, project_path: str):
+        self.project_path = project_path
+        self.dirs: list[SnapshotDir] = []
+        self._text_contents: dict[tuple[bool, bool], LazyTextContents] = {}
+        if os.path.isdir(project_path):
+            self._scan(project_path, os.path.basename(project_path), 0)
+
+    @classmethod
+    def of(cls, project: Union[str, 'ProjectSnapshot']) -> 'ProjectSnapshot':
+        if isinstance(project, ProjectSnapshot):
+            return project
+        return cls(project)
+
+    def _scan(self, dir_path: str, dir_name: str, depth: int):
+        dir_entries, files = [], []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    dir_entries.append(entry)
+                    continue
+                try:
+                    stat = entry.stat()
+                    files.append(SnapshotFile(entry.path, entry.name, stat.st_size, stat.st_mtime_ns))
+                except OSError:
+                    files.append(SnapshotFile(entry.path, entry.name, None, None))
+
+        self.dirs.append(SnapshotDir(dir_path, dir_name, depth, [entry.name for entry in dir_entries], files))
+        for entry in dir_entries:
+            if not entry.is_symlink():
+                self._scan(entry.path, entry.name, depth + 1)
+
+    def iter_dirs(self, ignore_hidden: bool = False) -> Iterator[SnapshotDir]:
+        """Yields directories top-down, hidden directories are skipped with their subtrees if requested."""
+        hidden_dirs = set()
+        for snapshot_dir in self.dirs:
+            if ignore_hidden and snapshot_dir.depth > 0 and (
+                    is_hidden(snapshot_dir.name) or os.path.dirname(snapshot_dir.path) in hidden_dirs):
+                hidden_dirs.add(snapshot_dir.path)
+                continue
+            yield snapshot_dir
+
+    def iter_files(self, ignore_hidden: bool = True, ignore_media: bool = True) -> Iterator[SnapshotFile]:
+        for snapshot_dir in self.iter_dirs(ignore_hidden):
+            for file in snapshot_dir.files:
+                if ignore_hidden and is_hidden(file.name) or ignore_media and is_media(file.name):
+                    continue
+                yield file
+
+    def get_text_contents(self, ignore_hidden: bool = True, ignore_media: bool = True) -> 'LazyTextContents':
+        """Returns contents of text files by their paths, contents are read from disk on access."""
+        key = (ignore_hidden, ignore_media)
+        if key not in self._text_contents:
+            self._text_contents[key] = LazyTextContents(
+                [file for file in self.iter_files(ignore_hidden, ignore_media) if is_text_file(file)])
+        return self._text_contents[key]
+
+    def render_tree(self) -> str:
+        """Renders the file tree like the `tree` command does: hidden entries are omitted, media files are listed."""
+        dirs_by_path = {snapshot_dir.path: snapshot_dir for snapshot_dir in self.dirs}
+        lines = [self.project_path]
+        dirs_count, files_count = 0, 0
+
+        def render_dir(snapshot_dir: SnapshotDir, prefix: str):
+            nonlocal dirs_count, files_count
+            entries = sorted([(name, os.path.join(snapshot_dir.path, name)) for name in snapshot_dir.dir_names
+                              if not is_hidden(name)] +
+                             [(file.name, None) for file in snapshot_dir.files if not is_hidden(file.name)])
+            for i, (name, dir_path) in enumerate(entries):
+                is_last = i == len(entries) - 1
+                lines.append(f"{prefix}{'└── ' if is_last else '├── '}{name}")
+                if dir_path is None:
+                    files_count += 1
+                    continue
+                dirs_count += 1
+                if dir_path in dirs_by_path:
+                    render_dir(dirs_by_path[dir_path], prefix + ('    ' if is_last else '│   '))
+
+        if len(self.dirs) > 0:
+            render_dir(self.dirs[0], '')
+        lines.append('')
+        lines.append(f"{dirs_count} {'directory' if dirs_count == 1 else 'directories'}, "
+                     f"{files_count} {'file' if files_count == 1 else 'files'}")
+        return '\n'.join(lines) + '\n'
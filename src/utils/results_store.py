@@ -0,0 +1,70 @@
+import csv
+import json
+import os
+import sqlite3
+import sys
+from typing import Any
+
+
+class ResultsStore:
+    """Append-only SQLite store of per-project results keyed by (config, full_name).
+
+    Skip checks are answered from an in-memory key set, so resuming a run does not re-read previous results.
+    Results can be exported to the csv format used by the notebooks and metrics scripts.
+    """
+
+    def __init__(self, db_path: str):
+        self._connection = sqlite3.connect(db_path)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'position INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'config TEXT NOT NULL, '
+                'full_name TEXT NOT NULL, '
+                'data TEXT NOT NULL, '
+                'UNIQUE (config, full_name))'
+            )
+        self._keys = set(self._connection.execute('SELECT config, full_name FROM results'))
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        return key in self._keys
+
+    def has_config(self, config: str) -> bool:
+        return any(key_config == config for key_config, _ in self._keys)
+
+    def append(self, config: str, result: dict[str, Any]):
+        full_name = result['full_name']
+        with self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO results (config, full_name, data) VALUES (?, ?, ?)',
+                                     (config, full_name, json.dumps(result, default=str)))
+        self._keys.add((config, full_name))
+
+    def get_results(self, config: str) -> list[dict[str, Any]]:
+        rows = self._connection.execute('SELECT data FROM results WHERE config = ? ORDER BY position', (config,))
+        return [json.loads(data) for data, in rows]
+
+    def import_csv(self, config: str, csv_path: str):
+        """Imports results collected before the store was introduced."""
+        if not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0:
+            return
+        # Intermediate steps of long trajectories exceed the default csv field size limit
+        csv.field_size_limit(sys.maxsize)
+        with open(csv_path, newline='') as f:
+            for result in csv.DictReader(f):
+                self.append(config, result)
+
+    def export_csv(self, config: str, csv_path: str):
+        results = self.get_results(config)
+        if len(results) == 0:
+            return
+        tmp_csv_path = f'{csv_path}.tmp'
+        with open(tmp_csv_path, 'w', newline='') as f:
+            # Results imported from older csv files may have other columns than the new ones
+            fieldnames = list(dict.fromkeys(key for result in results for key in result))
+            writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
+            writer.writeheader()
+            writer.writerows(results)
+        os.replace(tmp_csv_path, csv_path)
+
+    def close(self):
+        self._connection.close()